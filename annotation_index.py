@@ -0,0 +1,229 @@
+import os, sys, gzip, json, re
+import numpy as np
+
+# Directory holding the array tables built from an Ensembl GTF
+ANNOTATION_INDEX = os.environ.get("CRISPR_ANNOTATION_INDEX", "annotation_index")
+# "local" resolves only from the index, "remote" only via UniProt/EBI, "auto" tries the index first
+GENE_RESOLVER = os.environ.get("CRISPR_GENE_RESOLVER", "auto")
+
+GENE_DTYPE = np.dtype([
+    ("gene_id", "S24"), ("symbol", "S32"), ("chromosome", "S16"), ("strand", "i1"),
+    ("tx_lo", "i4"), ("tx_hi", "i4"),
+])
+TRANSCRIPT_DTYPE = np.dtype([
+    ("transcript_id", "S24"), ("gene", "i4"), ("canonical", "i1"), ("cds_length", "i4"),
+    ("exon_lo", "i4"), ("exon_hi", "i4"),
+])
+EXON_DTYPE = np.dtype([
+    ("exon_id", "S24"), ("exon_number", "i4"), ("start", "i8"), ("end", "i8"),
+    ("cds_start", "i8"), ("cds_end", "i8"),
+])
+INDEX_FILES = ("genes", "transcripts", "exons", "symbols", "symbol_rows", "gene_ids", "gene_id_rows")
+
+_ATTRIBUTE = re.compile(r'(\S+) "?([^";]*)"?;')
+
+
+# Function to normalise GTF contig names to the Ensembl/EBI style ("1", "X", "MT")
+def normalise_chromosome(name):
+    if name.startswith("chr"):
+        name = name[3:]
+    return "MT" if name == "M" else name
+
+
+# Function to parse a (gzipped) GTF into the gene, transcript and exon tables
+def build_index(gtf_path, out_dir=ANNOTATION_INDEX):
+    genes = {}
+    transcripts = {}
+    exons = {}
+    cds = {}
+    opener = gzip.open if gtf_path.endswith(".gz") else open
+    with opener(gtf_path, "rt") as gtf_file:
+        for line in gtf_file:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9 or fields[2] not in ("gene", "transcript", "exon", "CDS"):
+                continue
+            feature, start, end = fields[2], int(fields[3]), int(fields[4])
+            attributes = dict(_ATTRIBUTE.findall(fields[8]))
+            tags = re.findall(r'tag "([^"]*)"', fields[8])
+            gene_id = attributes.get("gene_id")
+            if feature == "gene":
+                genes[gene_id] = (
+                    attributes.get("gene_name", gene_id), normalise_chromosome(fields[0]),
+                    1 if fields[6] == "+" else -1,
+                )
+                continue
+            transcript_id = attributes.get("transcript_id")
+            if feature == "transcript":
+                transcripts[transcript_id] = [gene_id, int("Ensembl_canonical" in tags)]
+            elif feature == "exon":
+                exons.setdefault(transcript_id, []).append(
+                    (attributes.get("exon_id", ""), int(attributes.get("exon_number", 0)), start, end)
+                )
+            else:
+                # CDS alone gives the coding span of each exon; like EBI's coordinates it excludes the stop codon
+                key = (transcript_id, int(attributes.get("exon_number", 0)))
+                lo, hi = cds.get(key, (start, end))
+                cds[key] = (min(lo, start), max(hi, end))
+
+    gene_rows = sorted(genes)
+    gene_row_of = {gene_id: row for row, gene_id in enumerate(gene_rows)}
+    tx_by_gene = {}
+    for transcript_id, (gene_id, _) in transcripts.items():
+        if gene_id in gene_row_of:
+            tx_by_gene.setdefault(gene_id, []).append(transcript_id)
+
+    gene_table = np.zeros(len(gene_rows), dtype=GENE_DTYPE)
+    transcript_table = np.zeros(len(transcripts), dtype=TRANSCRIPT_DTYPE)
+    exon_table = np.zeros(sum(len(v) for v in exons.values()), dtype=EXON_DTYPE)
+    tx_row = exon_row = 0
+    for row, gene_id in enumerate(gene_rows):
+        symbol, chromosome, strand = genes[gene_id]
+        gene_table[row] = (gene_id, symbol, chromosome, strand, tx_row, tx_row)
+        for transcript_id in sorted(tx_by_gene.get(gene_id, [])):
+            tx_exons = sorted(exons.get(transcript_id, []), key=lambda exon: exon[1])
+            cds_length = 0
+            first_exon = exon_row
+            for exon_id, exon_number, start, end in tx_exons:
+                cds_start, cds_end = cds.get((transcript_id, exon_number), (0, 0))
+                if cds_start:
+                    cds_length += cds_end - cds_start + 1
+                exon_table[exon_row] = (exon_id, exon_number, start, end, cds_start, cds_end)
+                exon_row += 1
+            transcript_table[tx_row] = (
+                transcript_id, row, transcripts[transcript_id][1], cds_length, first_exon, exon_row
+            )
+            tx_row += 1
+        gene_table[row]["tx_hi"] = tx_row
+    transcript_table = transcript_table[:tx_row]
+    exon_table = exon_table[:exon_row]
+
+    symbols = np.char.upper(gene_table["symbol"])
+    symbol_rows = np.argsort(symbols, kind="stable").astype("i4")
+    gene_id_rows = np.argsort(gene_table["gene_id"], kind="stable").astype("i4")
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "genes.npy"), gene_table)
+    np.save(os.path.join(out_dir, "transcripts.npy"), transcript_table)
+    np.save(os.path.join(out_dir, "exons.npy"), exon_table)
+    np.save(os.path.join(out_dir, "symbols.npy"), symbols[symbol_rows])
+    np.save(os.path.join(out_dir, "symbol_rows.npy"), symbol_rows)
+    np.save(os.path.join(out_dir, "gene_ids.npy"), gene_table["gene_id"][gene_id_rows])
+    np.save(os.path.join(out_dir, "gene_id_rows.npy"), gene_id_rows)
+    with open(os.path.join(out_dir, "source.json"), "w") as source_file:
+        json.dump({"gtf": os.path.basename(gtf_path), "genes": len(gene_table),
+                   "transcripts": len(transcript_table), "exons": len(exon_table)}, source_file)
+    print(f"Indexed {len(gene_table)} genes, {len(transcript_table)} transcripts, {len(exon_table)} exons into {out_dir}")
+
+
+class AnnotationIndex:
+    """Memory-mapped view of the gene/transcript/exon tables written by build_index."""
+
+    def __init__(self, index_dir=ANNOTATION_INDEX):
+        self.index_dir = index_dir
+        self._tables = {}
+
+    def _table(self, name):
+        # Tables are opened on first use and stay memory-mapped
+        if name not in self._tables:
+            self._tables[name] = np.load(os.path.join(self.index_dir, f"{name}.npy"), mmap_mode="r")
+        return self._tables[name]
+
+    def _search(self, keys_name, rows_name, key):
+        keys = self._table(keys_name)
+        position = np.searchsorted(keys, key)
+        if position < len(keys) and keys[position] == key:
+            return int(self._table(rows_name)[position])
+        return None
+
+    def find_gene(self, gene):
+        gene = gene.strip()
+        if gene.upper().startswith("ENSG"):
+            row = self._search("gene_ids", "gene_id_rows", gene.split(".")[0].encode())
+            if row is not None:
+                return row
+        return self._search("symbols", "symbol_rows", gene.upper().encode())
+
+    def _pick_transcript(self, gene_row):
+        gene = self._table("genes")[gene_row]
+        transcripts = self._table("transcripts")[gene["tx_lo"]:gene["tx_hi"]]
+        if len(transcripts) == 0:
+            return None
+        # Prefer the Ensembl canonical transcript, then the longest CDS, then the most exons
+        order = np.lexsort((
+            transcripts["exon_hi"] - transcripts["exon_lo"], transcripts["cds_length"], transcripts["canonical"]
+        ))
+        return gene["tx_lo"] + int(order[-1])
+
+    def coding_genes(self):
+        """(symbol, Ensembl gene ID) of every gene with at least one protein-coding transcript."""
+        genes = self._table("genes")
+        coding = np.zeros(len(genes), dtype=bool)
+        transcripts = self._table("transcripts")
+        coding[transcripts["gene"][transcripts["cds_length"] > 0]] = True
+        return [(gene["symbol"].decode(), gene["gene_id"].decode()) for gene in genes[coding]]
+
+    def aliases(self, gene):
+        """Upper-case symbol and versionless Ensembl gene ID of a gene, or an empty list if it is unknown."""
+        gene_row = self.find_gene(gene)
+        if gene_row is None:
+            return []
+        record = self._table("genes")[gene_row]
+        return [record["symbol"].decode().upper(), record["gene_id"].decode().split(".")[0]]
+
+    def last_exon(self, gene):
+        """Return the last coding exon of a gene in the same shape as the EBI-derived last_exon_info."""
+        gene_row = self.find_gene(gene)
+        if gene_row is None:
+            return None
+        transcript_row = self._pick_transcript(gene_row)
+        if transcript_row is None:
+            return None
+        gene_record = self._table("genes")[gene_row]
+        transcript = self._table("transcripts")[transcript_row]
+        exons = self._table("exons")[transcript["exon_lo"]:transcript["exon_hi"]]
+        coding = exons[exons["cds_start"] > 0]
+        if len(coding):
+            exon = coding[-1]
+            start, end = int(exon["cds_start"]), int(exon["cds_end"])
+        else:
+            exon = exons[-1]
+            start, end = int(exon["start"]), int(exon["end"])
+        # EBI reports minus-strand exons with begin > end; keep that convention
+        if gene_record["strand"] < 0:
+            start, end = end, start
+        return {
+            "ensembl_gene_id": gene_record["gene_id"].decode(),
+            "exon_id": exon["exon_id"].decode(),
+            "chromosome": gene_record["chromosome"].decode(),
+            "start": start,
+            "end": end,
+        }
+
+
+_index = None
+
+
+# Function to open the annotation index if it has been built
+def get_annotation_index():
+    global _index
+    if _index is None:
+        if not all(os.path.exists(os.path.join(ANNOTATION_INDEX, f"{name}.npy")) for name in INDEX_FILES):
+            return None
+        _index = AnnotationIndex(ANNOTATION_INDEX)
+    return _index
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "build":
+        build_index(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else ANNOTATION_INDEX)
+    elif len(sys.argv) > 1:
+        index = get_annotation_index()
+        if index is None:
+            print(f"No annotation index found in {ANNOTATION_INDEX}")
+            sys.exit(1)
+        for gene in sys.argv[1:]:
+            print(index.last_exon(gene))
+    else:
+        print("Usage: python annotation_index.py build <gtf> [out_dir] | <gene> [<gene> ...]")
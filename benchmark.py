@@ -0,0 +1,333 @@
+"""Offline benchmark: the full pipeline and the Flask endpoints against recorded REST fixtures and a fake FlashFry.
+
+    python benchmark.py [--genes 20] [--clients 4] [--guides-per-gene 5000] [--fixtures DIR] [--json out.json]
+    python benchmark.py record GENE[,GENE...] DIR     # save live UniProt/EBI responses as fixtures
+
+A local HTTP server stands in for UniProt, EBI and Ensembl. It replays idmapping.json and coordinates/<acc>.json
+from the fixture directory and invents deterministic fixtures for any gene without one. Region sequence is always
+generated from the coordinates. The fake FlashFry enumerates sites natively and writes a scored TSV of
+realistic shape at the requested size. Nothing touches the network.
+"""
+import os, sys, json, time, random, shutil, tempfile, threading, argparse, hashlib, re
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# Extra columns FlashFry writes next to the ranking metrics, so the fake TSV is as wide as a real one
+FAKE_EXTRA_COLUMNS = ["otCount", "dangerous_GC", "dangerous_polyT", "dangerous_in_genome", "basesDiffToClosestHit",
+                      "closestHitCount", "Moreno-Mateos2015OnTarget_rank", "otSites"]
+
+
+# Function to make a deterministic fixture for a gene that has no recorded one
+def synthetic_fixture(gene):
+    seed = int(hashlib.sha256(gene.encode()).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    accession = f"Q{seed % 100000:05d}"
+    chromosome = str(rng.randint(1, 22))
+    exons = []
+    position = rng.randint(1_000_000, 100_000_000)
+    for number in range(rng.randint(3, 12)):
+        length = rng.randint(60, 400)
+        exons.append((position, position + length - 1))
+        position += length + rng.randint(500, 20_000)
+    reverse = seed % 2 == 1
+    coordinates = {"accession": accession, "gnCoordinate": [{
+        "ensemblGeneId": f"ENSG{seed % 10**11:011d}",
+        "genomicLocation": {"chromosome": chromosome, "reverseStrand": reverse, "exon": [
+            # Minus-strand exons run from the higher coordinate down
+            {"id": f"ENSE{seed % 10**9:09d}{i:02d}", "genomeLocation": {
+                "begin": {"position": end if reverse else start}, "end": {"position": start if reverse else end}}}
+            for i, (start, end) in enumerate(exons)
+        ]},
+    }]}
+    return [accession], coordinates
+
+
+# Function to generate the same pseudo-random sequence for a region every time
+def region_sequence(chromosome, start, end):
+    seed = int(hashlib.sha256(f"{chromosome}:{start}".encode()).hexdigest()[:8], 16)
+    codes = np.random.default_rng(seed).integers(0, 4, end - start + 1)
+    return np.frombuffer(b"ACGT", dtype=np.uint8)[codes].tobytes().decode()
+
+
+class FixtureServer:
+    """Stub UniProt/EBI/Ensembl server replaying fixtures with an optional per-request latency."""
+
+    def __init__(self, fixture_dir=None, latency=0.0, mapping_delay=0.0):
+        self.latency = latency
+        self.mapping_delay = mapping_delay
+        self.id_mapping = {}
+        self.coordinates = {}
+        self.jobs = {}
+        self._lock = threading.Lock()
+        if fixture_dir:
+            mapping_path = os.path.join(fixture_dir, "idmapping.json")
+            if os.path.exists(mapping_path):
+                with open(mapping_path) as mapping_file:
+                    self.id_mapping = {gene.upper(): ids for gene, ids in json.load(mapping_file).items()}
+            coordinate_dir = os.path.join(fixture_dir, "coordinates")
+            if os.path.isdir(coordinate_dir):
+                for name in os.listdir(coordinate_dir):
+                    with open(os.path.join(coordinate_dir, name)) as coordinate_file:
+                        self.coordinates[name[:-len(".json")]] = json.load(coordinate_file)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def accessions(self, gene):
+        gene = gene.upper()
+        with self._lock:
+            if gene not in self.id_mapping:
+                accessions, coordinates = synthetic_fixture(gene)
+                self.id_mapping[gene] = accessions
+                self.coordinates.setdefault(accessions[0], coordinates)
+            return self.id_mapping[gene]
+
+    def _handler(self):
+        fixtures = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, payload, status=200, headers=None):
+                time.sleep(fixtures.latency)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+                if self.path == "/idmapping/run":
+                    genes = form.get("ids", [""])[0].split(",")
+                    job_id = hashlib.sha1(f"{time.time()}{genes}".encode()).hexdigest()[:16]
+                    fixtures.jobs[job_id] = (time.time(), genes)
+                    return self._reply({"jobId": job_id})
+                self._reply({"error": "not found"}, 404)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                query = parse_qs(urlparse(self.path).query)
+                match = re.match(r"/idmapping/(status|results)/(\w+)$", path)
+                if match and match.group(2) in fixtures.jobs:
+                    submitted, genes = fixtures.jobs[match.group(2)]
+                    if match.group(1) == "status":
+                        running = time.time() - submitted < fixtures.mapping_delay
+                        return self._reply({"jobStatus": "RUNNING" if running else "FINISHED"})
+                    results = [{"from": gene, "to": accession} for gene in genes for accession in fixtures.accessions(gene)]
+                    # Paginated like UniProt: a page of `size` results and a Link header to the next one
+                    size = int(query.get("size", [25])[0])
+                    cursor = int(query.get("cursor", [0])[0])
+                    headers = {}
+                    if cursor + size < len(results):
+                        next_url = f"{fixtures.url}{path}?size={size}&cursor={cursor + size}"
+                        headers["Link"] = f'<{next_url}>; rel="next"'
+                    return self._reply({"results": results[cursor:cursor + size]}, headers=headers)
+                match = re.match(r"/proteins/api/coordinates/(\w+)$", path)
+                if match and match.group(1) in fixtures.coordinates:
+                    return self._reply(fixtures.coordinates[match.group(1)])
+                match = re.match(r"/sequence/region/human/(\w+):(\d+)\.\.(\d+):1$", path)
+                if match:
+                    chromosome, start, end = match.group(1), int(match.group(2)), int(match.group(3))
+                    return self._reply({"seq": region_sequence(chromosome, start, end)})
+                self._reply({"error": "not found"}, 404)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# Function to build a FlashFry stand-in writing discover output natively and a scored TSV of the requested size
+def fake_flashfry(guides_per_gene, latency=0.0):
+    import pandas as pd
+    from pam_discovery import discover_fasta
+
+    def run(args):
+        time.sleep(latency)
+        output = args[args.index("--output") + 1]
+        if args[0] == "discover":
+            discover_fasta(args[args.index("--fasta") + 1]).to_csv(output, sep="\t", index=False)
+            return
+        sites = pd.read_csv(args[args.index("--input") + 1], sep="\t", keep_default_na=False)
+        # Repeat each gene's real sites up to the requested row count; the repeats stay locatable in the window
+        sites = pd.concat([group.iloc[np.resize(np.arange(len(group)), guides_per_gene)]
+                           for _, group in sites.groupby("contig", sort=False)], ignore_index=True)
+        rng = np.random.default_rng(len(sites))
+        n = len(sites)
+        sites["Doench2014OnTarget"] = rng.random(n).round(6)
+        sites["DoenchCFD_maxOT"] = rng.random(n).round(6)
+        sites["DoenchCFD_specificityscore"] = rng.random(n).round(6)
+        sites["Hsu2013"] = rng.integers(0, 101, n).astype(float)
+        sites["Moreno-Mateos2015OnTarget"] = rng.random(n).round(6)
+        for column in FAKE_EXTRA_COLUMNS:
+            sites[column] = "NONE" if column.startswith("dangerous") else rng.integers(0, 50, n)
+        sites.to_csv(output, sep="\t", index=False)
+
+    return run
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return {}
+    return {"n": int(len(values)), "p50": float(np.percentile(values, 50)), "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+
+# Function to push one submission through the HTTP endpoints the way a browser would
+def drive_submission(base_url, genes, latencies, lock):
+    import requests
+    session = requests.Session()
+
+    def timed(name, method, url, **kwargs):
+        started = time.perf_counter()
+        response = session.request(method, base_url + url, **kwargs)
+        with lock:
+            latencies.setdefault(name, []).append(time.perf_counter() - started)
+        return response
+
+    started = time.perf_counter()
+    response = timed("submit", "POST", "/submit", data={"gene_ids": ",".join(genes)}, allow_redirects=False)
+    location = response.headers["Location"]
+    job_id = location.rsplit("/", 1)[-1] if "/progress/" in location else parse_qs(urlparse(location).query)["job_id"][0]
+    version = -1
+    while True:
+        status = timed("job_status", "GET", f"/jobs/{job_id}?since={version}").json()
+        version = status["version"]
+        if status["state"] in ("done", "failed"):
+            break
+    with lock:
+        latencies.setdefault("job_end_to_end", []).append(time.perf_counter() - started)
+    if status["state"] != "done":
+        return status["error"]
+    timed("dataframe", "GET", urlparse(status["redirect_url"]).path + "?job_id=" + job_id)
+    selected = timed("select_row", "POST", "/select_row",
+                     data={"row_index": 0, "gene_ids": status["gene_ids"].split(",")[0], "job_id": job_id}).json()
+    if selected.get("redirect_url"):
+        timed("show_design", "GET", selected["redirect_url"])
+    timed("metrics", "GET", "/metrics")
+    return None
+
+
+# Function to gather per-stage wall times from every job's timings.json
+def stage_report(jobs_dir):
+    from metrics import TIMINGS_FILE
+    seconds, data = {}, {}
+    for job_id in os.listdir(jobs_dir):
+        path = os.path.join(jobs_dir, job_id, TIMINGS_FILE)
+        if not os.path.exists(path):
+            continue
+        with open(path) as timings_file:
+            for span in json.load(timings_file)["spans"]:
+                seconds.setdefault(span["stage"], []).append(span["seconds"])
+                data[span["stage"]] = data.get(span["stage"], 0) + span["bytes"]
+    return {stage: {**percentiles(values), "total_s": float(sum(values)), "bytes": data[stage]}
+            for stage, values in seconds.items()}
+
+
+def print_table(title, rows, elapsed):
+    print(f"\n{title}")
+    print(f"{'name':<22}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'per s':>9}")
+    for name, stats in sorted(rows.items()):
+        if not stats:
+            continue
+        print(f"{name:<22}{stats['n']:>6}{stats['p50'] * 1000:>10.1f}{stats['p90'] * 1000:>10.1f}"
+              f"{stats['p99'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}{stats['n'] / elapsed:>9.2f}")
+
+
+def run_benchmark(options):
+    workdir = tempfile.mkdtemp(prefix="crispr-benchmark-")
+    fixtures = FixtureServer(options.fixtures, options.latency / 1000, options.mapping_delay).start()
+    # Point every module at the stub and at throwaway caches before they read their settings
+    os.environ.update({
+        "CRISPR_UNIPROT_SERVER": fixtures.url, "CRISPR_EBI_SERVER": fixtures.url, "CRISPR_ENSEMBL_SERVER": fixtures.url,
+        "CRISPR_SEQUENCE_SOURCE": "ensembl", "CRISPR_GENE_RESOLVER": "remote",
+        "CRISPR_LOOKUP_CACHE": os.path.join(workdir, "lookup_cache.sqlite3"),
+        "CRISPR_RESULT_CACHE": os.path.join(workdir, "result_cache"),
+        "CRISPR_JOBS_DIR": os.path.join(workdir, "jobs"),
+        "CRISPR_MAX_JOBS": str(options.workers), "CRISPR_FLASHFRY_WORKERS": "0",
+    })
+    from werkzeug.serving import make_server
+    import pipeline
+    import server
+    pipeline.run_flashfry = fake_flashfry(options.guides_per_gene, options.flashfry_latency / 1000)
+
+    app_server = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=app_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{app_server.server_port}"
+
+    genes = [f"BENCH{i:04d}" for i in range(options.genes)]
+    batches = [genes[i:i + options.batch] for i in range(0, len(genes), options.batch)]
+    if options.repeat:
+        # Second pass over the same genes measures the result-cache path
+        batches = batches + batches
+    latencies, lock = {}, threading.Lock()
+    print(f"Benchmarking {len(batches)} submission(s) of up to {options.batch} gene(s), {options.clients} client(s), "
+          f"{options.guides_per_gene} scored guides per gene")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.clients) as clients:
+        errors = [error for error in clients.map(lambda batch: drive_submission(base_url, batch, latencies, lock), batches)
+                  if error]
+    elapsed = time.perf_counter() - started
+
+    endpoints = {name: percentiles(values) for name, values in latencies.items()}
+    stages = stage_report(os.environ["CRISPR_JOBS_DIR"])
+    print_table("Endpoints (client-side)", endpoints, elapsed)
+    print_table("Stages (from timings.json)", stages, elapsed)
+    print(f"\n{len(batches)} submissions in {elapsed:.2f}s ({len(batches) / elapsed:.2f}/s), {len(errors)} failed")
+    for error in errors[:5]:
+        print(f"  failed: {error}")
+    if options.json:
+        with open(options.json, "w") as report_file:
+            json.dump({"elapsed_s": elapsed, "submissions": len(batches), "failed": len(errors),
+                       "options": vars(options), "endpoints": endpoints, "stages": stages}, report_file, indent=2)
+    app_server.shutdown()
+    fixtures.stop()
+    if not options.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if errors else 0
+
+
+# Function to record live UniProt/EBI responses for a gene list as replayable fixtures
+def record_fixtures(genes, out_dir):
+    from crispr_webtooltest import map_gene_ids_by_gene, fetch_coordinates
+    os.makedirs(os.path.join(out_dir, "coordinates"), exist_ok=True)
+    mapping = map_gene_ids_by_gene(genes, "GeneCards", "UniProtKB")
+    with open(os.path.join(out_dir, "idmapping.json"), "w") as mapping_file:
+        json.dump(mapping, mapping_file, indent=2)
+    for accessions in mapping.values():
+        for accession in accessions:
+            with open(os.path.join(out_dir, "coordinates", f"{accession}.json"), "w") as coordinate_file:
+                json.dump(fetch_coordinates(accession), coordinate_file)
+    print(f"Recorded {len(mapping)} gene(s) into {out_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record_fixtures([gene for gene in sys.argv[2].split(",") if gene], sys.argv[3])
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="Offline CRISPR pipeline benchmark")
+    parser.add_argument("--genes", type=int, default=20, help="distinct genes to design")
+    parser.add_argument("--batch", type=int, default=1, help="genes per submission")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent HTTP clients")
+    parser.add_argument("--workers", type=int, default=2, help="job pool size (CRISPR_MAX_JOBS)")
+    parser.add_argument("--guides-per-gene", type=int, default=5000, help="rows per gene in the fake scored TSV")
+    parser.add_argument("--latency", type=float, default=20, help="stub REST latency per request, ms")
+    parser.add_argument("--mapping-delay", type=float, default=0.3, help="seconds a UniProt mapping job stays RUNNING")
+    parser.add_argument("--flashfry-latency", type=float, default=0, help="added fake FlashFry latency per call, ms")
+    parser.add_argument("--fixtures", help="directory of recorded fixtures (see `record`)")
+    parser.add_argument("--repeat", action="store_true", help="submit every batch twice to measure cache hits")
+    parser.add_argument("--json", help="also write the report as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    sys.exit(run_benchmark(parser.parse_args()))
@@ -0,0 +1,310 @@
+import os, re, sys, json, queue, select, socket, socketserver, subprocess, threading, time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import stage
+
+# FlashFry configuration shared by the worker service and the cold-start fallback
+FLASHFRY_JAR = os.environ.get("CRISPR_FLASHFRY_JAR", "FlashFry-assembly-1.15.jar")
+FLASHFRY_HEAP = os.environ.get("CRISPR_FLASHFRY_HEAP", "4g")
+FLASHFRY_MAIN = os.environ.get("CRISPR_FLASHFRY_MAIN", "main.scala.Main")
+FLASHFRY_DATABASE = os.environ.get("CRISPR_FLASHFRY_DATABASE", "GRCh38_cas9ngg_database")
+FLASHFRY_VERSION = os.environ.get(
+    "CRISPR_FLASHFRY_VERSION", (re.findall(r"(\d+(?:\.\d+)+)", os.path.basename(FLASHFRY_JAR)) or ["unknown"])[0]
+)
+SCORING_METRICS = "doench2014ontarget,doench2016cfd,dangerous,hsu2013,minot,moreno2015"
+FLASHFRY_WORKERS = int(os.environ.get("CRISPR_FLASHFRY_WORKERS", 1))
+FLASHFRY_SOCKET = os.path.abspath(os.environ.get("CRISPR_FLASHFRY_SOCKET", "flashfry_worker.sock"))
+FLASHFRY_TIMEOUT = int(os.environ.get("CRISPR_FLASHFRY_TIMEOUT", 1800))
+JAVA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "java")
+# Concurrent FlashFry runs; 0 sizes it from available memory and the heap each JVM reserves
+FLASHFRY_SLOTS = int(os.environ.get("CRISPR_FLASHFRY_SLOTS", 0))
+FLASHFRY_MEMORY_FRACTION = float(os.environ.get("CRISPR_FLASHFRY_MEMORY_FRACTION", 0.75))
+
+# Arguments whose values are file paths; the worker JVM has its own working directory
+PATH_OPTIONS = ("--database", "--fasta", "--input", "--output")
+
+
+# Function to convert a JVM heap size such as "4g" or "512m" to bytes
+def heap_bytes(heap=FLASHFRY_HEAP):
+    match = re.fullmatch(r"(\d+)([kKmMgGtT]?)", heap.strip())
+    if not match:
+        raise ValueError(f"Unrecognised FlashFry heap size {heap}")
+    return int(match.group(1)) * 1024 ** " kmgt".index(match.group(2).lower() or " ")
+
+
+# Function to read the memory the kernel reports as available to new processes, in bytes
+def available_memory():
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+# Function to size FlashFry concurrency so every admitted JVM's heap fits in the memory budget
+def admission_slots(slots=FLASHFRY_SLOTS, heap=FLASHFRY_HEAP, fraction=FLASHFRY_MEMORY_FRACTION):
+    if slots > 0:
+        return slots
+    return max(1, int(available_memory() * fraction // heap_bytes(heap)))
+
+
+class FlashFryAdmission:
+    """FIFO gate in front of FlashFry: at most `slots` runs at once, the rest wait in arrival order."""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.active = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    @contextmanager
+    def slot(self, on_wait=None):
+        """Hold one slot for the block; on_wait(position) is called whenever the 1-based queue position changes."""
+        ticket = object()
+        with stage("flashfry_queue"), self._cond:
+            self._waiting.append(ticket)
+            position = None
+            try:
+                while not (self._waiting[0] is ticket and self.active < self.slots):
+                    if on_wait is not None and self._waiting.index(ticket) + 1 != position:
+                        position = self._waiting.index(ticket) + 1
+                        on_wait(position)
+                    self._cond.wait()
+            except BaseException:
+                # Leave the queue so the jobs behind are not stuck on this ticket
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._waiting.popleft()
+            self.active += 1
+            # The next in line may also fit
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_admission():
+    global _admission
+    with _admission_lock:
+        if _admission is None:
+            _admission = FlashFryAdmission(admission_slots())
+            print(f"FlashFry admission: {_admission.slots} concurrent run(s) of -Xmx{FLASHFRY_HEAP}", flush=True)
+    return _admission
+
+
+# Function to build the cold `java -jar` command for a FlashFry argument list
+def cold_command(args):
+    return ["java", f"-Xmx{FLASHFRY_HEAP}", "-jar", FLASHFRY_JAR] + list(args)
+
+
+# Function to make file arguments absolute so any worker can resolve them
+def absolute_args(args, cwd=None):
+    cwd = cwd or os.getcwd()
+    args = list(args)
+    for i, arg in enumerate(args[:-1]):
+        if arg in PATH_OPTIONS and not os.path.isabs(args[i + 1]):
+            args[i + 1] = os.path.join(cwd, args[i + 1])
+    return args
+
+
+class FlashFryWorker:
+    """One long-lived JVM running java/FlashFryWorker.java over a stdin/stdout pipe."""
+
+    def __init__(self, jar=FLASHFRY_JAR, heap=FLASHFRY_HEAP, main_class=FLASHFRY_MAIN):
+        self.jar = os.path.abspath(jar)
+        self.heap = heap
+        self.main_class = main_class
+        self.process = None
+        self.restarts = 0
+        self.jobs = 0
+        self._lock = threading.Lock()
+
+    def _compile(self):
+        if not os.path.exists(os.path.join(JAVA_DIR, "FlashFryWorker.class")):
+            subprocess.run(
+                ["javac", "-cp", self.jar, "-d", JAVA_DIR, os.path.join(JAVA_DIR, "FlashFryWorker.java")],
+                check=True, capture_output=True, text=True,
+            )
+
+    def start(self):
+        self._compile()
+        self.process = subprocess.Popen(
+            ["java", f"-Xmx{self.heap}", "-cp", self.jar + os.pathsep + JAVA_DIR, "FlashFryWorker", self.main_class],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            bufsize=1, universal_newlines=True,
+        )
+        print(f"Started FlashFry worker (pid {self.process.pid})", flush=True)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _request(self, line, timeout):
+        self.process.stdin.write(line + "\n")
+        self.process.stdin.flush()
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError(f"FlashFry worker did not answer within {timeout}s")
+        reply = self.process.stdout.readline()
+        if not reply:
+            raise RuntimeError("FlashFry worker exited")
+        return reply.rstrip("\n")
+
+    def healthy(self, timeout=10):
+        with self._lock:
+            if not self.alive():
+                return False
+            try:
+                return self._request("PING", timeout) == "PONG"
+            except (OSError, TimeoutError, RuntimeError):
+                return False
+
+    def run(self, args, timeout=FLASHFRY_TIMEOUT):
+        """Run one FlashFry command; the JVM is restarted if it crashed or hung."""
+        with self._lock:
+            if not self.alive():
+                self.restart()
+            try:
+                reply = self._request("\t".join(args), timeout)
+            except (OSError, TimeoutError, RuntimeError) as e:
+                self.restart()
+                return False, str(e)
+            self.jobs += 1
+            if reply == "OK":
+                return True, ""
+            return False, reply[4:] if reply.startswith("ERR ") else reply
+
+
+class FlashFryPool:
+    """A fixed number of FlashFry workers shared between jobs, with periodic health checks."""
+
+    def __init__(self, size=FLASHFRY_WORKERS, health_interval=60):
+        self.workers = [FlashFryWorker() for _ in range(size)]
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            worker.start()
+            self._idle.put(worker)
+        self._health_thread = threading.Thread(target=self._check_health, args=(health_interval,), daemon=True)
+        self._health_thread.start()
+
+    def _check_health(self, interval):
+        while True:
+            time.sleep(interval)
+            # Only idle workers are probed; busy ones are checked when their job finishes
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if not worker.healthy():
+                    print("FlashFry worker failed health check, restarting", flush=True)
+                    worker.restart()
+                self._idle.put(worker)
+
+    def run(self, args):
+        worker = self._idle.get()
+        try:
+            return worker.run(args)
+        finally:
+            self._idle.put(worker)
+
+    def status(self):
+        return [
+            {"pid": worker.process.pid if worker.alive() else None, "jobs": worker.jobs, "restarts": worker.restarts}
+            for worker in self.workers
+        ]
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if request.get("command") == "status":
+            reply = {"ok": True, "workers": self.server.pool.status()}
+        else:
+            ok, message = self.server.pool.run(request["args"])
+            reply = {"ok": ok, "message": message}
+        self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class _PoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Function to start the worker pool behind a Unix socket in a background thread
+def start_service(size=FLASHFRY_WORKERS, socket_path=FLASHFRY_SOCKET):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = _PoolServer(socket_path, _RequestHandler)
+    server.pool = FlashFryPool(size)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"FlashFry service listening on {socket_path} with {size} worker(s)", flush=True)
+    return server
+
+
+# Function to send one command to the running service; returns None when no service is reachable
+def _run_via_service(args, socket_path=FLASHFRY_SOCKET):
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall((json.dumps({"args": args}) + "\n").encode())
+            reply = client.makefile().readline()
+    except OSError as e:
+        print(f"FlashFry service unavailable ({e}), falling back to a cold JVM")
+        return None
+    return json.loads(reply) if reply else None
+
+
+# Function to run a FlashFry command through the warm service, or a cold JVM if none is running
+def run_flashfry(args):
+    args = absolute_args(args)
+    reply = _run_via_service(args)
+    if reply is None:
+        return subprocess.run(cold_command(args), capture_output=True, text=True, check=True)
+    if not reply["ok"]:
+        raise subprocess.CalledProcessError(1, cold_command(args), output="", stderr=reply["message"])
+    return subprocess.CompletedProcess(cold_command(args), 0, stdout="Ran on warm FlashFry worker", stderr="")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        service = start_service(int(sys.argv[2]) if len(sys.argv) > 2 else FLASHFRY_WORKERS)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            service.shutdown()
+            service.pool.close()
+    else:
+        print("Usage: python flashfry_worker.py serve [workers]")
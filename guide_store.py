@@ -0,0 +1,145 @@
+"""Precomputed guide tables for every protein-coding gene, looked up by symbol or Ensembl gene ID.
+
+    python guide_store.py build library_out --workers 16
+
+runs the library pipeline over every coding gene in the annotation index and loads each gene's
+ranked table, donor inputs and donor designs into a SQLite file that the server reads first.
+"""
+import os, sys, json, time, sqlite3, threading, argparse
+
+from result_cache import result_key
+from annotation_index import get_annotation_index
+
+GUIDE_STORE = os.environ.get("CRISPR_GUIDE_STORE", "guide_store.sqlite3")
+
+
+# Function to normalise a gene name the way aliases are stored
+def alias_key(gene):
+    gene = gene.strip().upper()
+    return gene.split(".")[0] if gene.startswith("ENSG") else gene
+
+
+class GuideStore:
+    """SQLite file of per-gene results, stamped with the pipeline settings they were computed under."""
+
+    def __init__(self, path=GUIDE_STORE):
+        self.path = path
+        self._lock = threading.Lock()
+        # Row lookups by outcome for /metrics; "stale" rows were computed under other settings
+        self.lookups = {"hit": 0, "stale": 0, "missing": 0}
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " gene TEXT PRIMARY KEY, settings TEXT NOT NULL, table_csv TEXT NOT NULL,"
+            " variables TEXT NOT NULL, donors TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        # Every name a gene can be asked for (input name, symbol, Ensembl ID) points at its results row
+        self._conn.execute("CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, gene TEXT NOT NULL)")
+        self._conn.commit()
+
+    def put(self, gene, table_csv, variables, donors, aliases=()):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (gene, settings, table_csv, variables, donors, created)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (gene, result_key(gene), table_csv, json.dumps(variables), json.dumps(donors), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO aliases (alias, gene) VALUES (?, ?)",
+                [(alias_key(alias), gene) for alias in {gene, *aliases}],
+            )
+            self._conn.commit()
+
+    def _row(self, gene, columns):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT r.gene, r.settings{columns} FROM aliases a JOIN results r ON r.gene = a.gene WHERE a.alias = ?",
+                (alias_key(gene),),
+            ).fetchone()
+        # Rows computed under another build, window, FlashFry version or sequence data are left to the live pipeline
+        outcome = "missing" if row is None else "hit" if row[1] == result_key(row[0]) else "stale"
+        with self._lock:
+            self.lookups[outcome] += 1
+            warn = outcome == "stale" and self.lookups["stale"] == 1
+        if warn:
+            print(f"Guide store {self.path}: {row[0]} was built under other pipeline settings and is ignored; "
+                  f"rebuild the store with the server's configuration")
+        return row if outcome == "hit" else None
+
+    def has(self, gene):
+        return self._row(gene, "") is not None
+
+    def lookup(self, gene):
+        """Return (table_csv, variables, donors) for gene, or None if it is absent or stale."""
+        row = self._row(gene, ", r.table_csv, r.variables, r.donors")
+        if row is None:
+            return None
+        return row[2], json.loads(row[3]), json.loads(row[4])
+
+    def restore(self, gene, workdir):
+        """Write a stored result into workdir under the names the web views expect."""
+        found = self.lookup(gene)
+        if found is None:
+            return False
+        table_csv, variables, donors = found
+        variables["gene_ids"] = gene
+        with open(os.path.join(workdir, f"{gene}_CRISPR_tgts.csv"), "w") as file:
+            file.write(table_csv)
+        with open(os.path.join(workdir, f"{gene}_variables.json"), "w") as file:
+            json.dump(variables, file)
+        with open(os.path.join(workdir, f"{gene}_donors.json"), "w") as file:
+            json.dump(donors, file)
+        return True
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+_store = None
+
+
+# Function to open the guide store if it has been built
+def get_guide_store():
+    global _store
+    if _store is None:
+        if not os.path.exists(GUIDE_STORE):
+            return None
+        _store = GuideStore(GUIDE_STORE)
+    return _store
+
+
+# Function to store one finished gene with every name it can be looked up by
+def store_result(store, gene, table_csv, variables, donors):
+    annotation_index = get_annotation_index()
+    aliases = annotation_index.aliases(gene) if annotation_index is not None else []
+    store.put(gene, table_csv, variables, donors, aliases)
+
+
+if __name__ == "__main__":
+    from library import run_library, read_gene_list, LIBRARY_WORKERS, LIBRARY_SHARD_SIZE, LIBRARY_FORMAT
+
+    parser = argparse.ArgumentParser(description="Precompute the guide store")
+    parser.add_argument("command", choices=("build",))
+    parser.add_argument("out_dir", help="library output directory; rerunning with it resumes the build")
+    parser.add_argument("--genes", help="gene list file instead of every coding gene in the annotation index")
+    parser.add_argument("--store", default=GUIDE_STORE, help="SQLite file to fill")
+    parser.add_argument("--workers", type=int, default=LIBRARY_WORKERS,
+                        help="pipeline processes (default: CPUs, capped at the FlashFry memory budget)")
+    parser.add_argument("--shard-size", type=int, default=LIBRARY_SHARD_SIZE, help="genes per pipeline run")
+    parser.add_argument("--format", default=LIBRARY_FORMAT, choices=("parquet", "csv"), help="library output format")
+    options = parser.parse_args()
+    if options.genes:
+        genes = read_gene_list(options.genes)
+    elif get_annotation_index() is not None:
+        genes = list(dict.fromkeys(symbol for symbol, _ in get_annotation_index().coding_genes()))
+    else:
+        print("No annotation index; build it with annotation_index.py or pass --genes", file=sys.stderr)
+        sys.exit(1)
+    try:
+        run_library(genes, options.out_dir, options.workers, options.shard_size, options.format,
+                    store=GuideStore(options.store))
+    except (ImportError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
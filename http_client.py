@@ -0,0 +1,103 @@
+import os, time, random, asyncio, threading
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Shared HTTP settings for UniProt, EBI and Ensembl calls
+HTTP_TIMEOUT = float(os.environ.get("CRISPR_HTTP_TIMEOUT", 30))
+HTTP_RETRIES = int(os.environ.get("CRISPR_HTTP_RETRIES", 4))
+HTTP_POOL_SIZE = int(os.environ.get("CRISPR_HTTP_POOL_SIZE", 16))
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Failures that only leave one item of run_concurrently unresolved; any other exception is a bug and is re-raised
+EXPECTED_ERRORS = (requests.RequestException, OSError, ValueError, RuntimeError)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Function to get the process-wide session; urllib3 keeps one keep-alive pool per host
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+# Function to compute a full-jitter exponential backoff delay
+def backoff_delay(attempt, base=0.25, cap=8.0):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Function to send a request with a timeout and jittered retries on connection errors and 429/5xx
+def request(method, url, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, **kwargs):
+    session = get_session()
+    for attempt in range(retries + 1):
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        metrics.add_bytes(len(response.content))
+        if response.status_code in RETRY_STATUS and attempt < retries:
+            retry_after = response.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff_delay(attempt)
+            time.sleep(delay)
+            continue
+        return response
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+# Function to poll check() until it returns a non-None value, starting fast and backing off
+def poll(check, initial=0.2, factor=1.6, max_delay=5.0, timeout=600):
+    delay = initial
+    deadline = time.monotonic() + timeout
+    while True:
+        result = check()
+        if result is not None:
+            return result
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Polling gave up after {timeout}s")
+        time.sleep(delay)
+        delay = min(max_delay, delay * factor)
+
+
+async def _gather_limited(func, items, limit):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await asyncio.to_thread(func, item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+# Function to run func over items concurrently on the event loop with at most `limit` in flight
+def run_concurrently(func, items, limit=HTTP_POOL_SIZE, errors=None):
+    """Results in item order. An expected failure gives None and, if errors is a dict, errors[item] = message."""
+    items = list(items)
+    results = asyncio.run(_gather_limited(func, items, limit))
+    for i, (item, result) in enumerate(zip(items, results)):
+        if isinstance(result, BaseException):
+            if not isinstance(result, EXPECTED_ERRORS):
+                raise result
+            print(f"Concurrent task failed for {item}: {result}")
+            if errors is not None:
+                errors[item] = f"{type(result).__name__}: {result}"
+            results[i] = None
+    return results
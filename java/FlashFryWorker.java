@@ -0,0 +1,40 @@
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+
+/**
+ * Keeps one JVM with FlashFry loaded and runs a FlashFry command per line of stdin.
+ *
+ * Each request is a tab-separated argument list ("discover\t--database\t..."), answered on
+ * stdout with "OK" or "ERR message". "PING" is answered with "PONG" for health checks.
+ * FlashFry's own console output is redirected to stderr so it cannot corrupt the protocol.
+ */
+public class FlashFryWorker {
+    public static void main(String[] argv) throws Exception {
+        String mainClass = argv.length > 0 ? argv[0] : "main.scala.Main";
+        Method entry = Class.forName(mainClass).getMethod("main", String[].class);
+
+        PrintStream protocol = System.out;
+        System.setOut(System.err);
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.equals("PING")) {
+                protocol.println("PONG");
+            } else if (!line.isEmpty()) {
+                try {
+                    entry.invoke(null, (Object) line.split("\t"));
+                    protocol.println("OK");
+                } catch (InvocationTargetException e) {
+                    protocol.println("ERR " + String.valueOf(e.getCause()).replace('\n', ' '));
+                } catch (Throwable t) {
+                    protocol.println("ERR " + String.valueOf(t).replace('\n', ' '));
+                }
+            }
+            protocol.flush();
+        }
+    }
+}
@@ -0,0 +1,189 @@
+import os, time, uuid, shutil, threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Scheduler settings for web-submitted jobs
+JOBS_DIR = os.path.abspath(os.environ.get("CRISPR_JOBS_DIR", "jobs"))
+MAX_CONCURRENT_JOBS = int(os.environ.get("CRISPR_MAX_JOBS", 2))
+JOB_TTL = int(os.environ.get("CRISPR_JOB_TTL", 24 * 3600))
+# Jobs allowed to wait for a worker; submissions beyond this are turned away with a retry hint
+MAX_QUEUED_JOBS = int(os.environ.get("CRISPR_MAX_QUEUED_JOBS", 20))
+
+# Progress percentages reported by the pipeline and the stage each one starts
+STAGES = [(0, "queued"), (10, "resolve"), (40, "fetch"), (45, "flashfry_queue"), (50, "discover"), (60, "score"), (80, "rank"), (85, "design"), (90, "persist"), (100, "done")]
+
+
+def stage_for(progress):
+    stage = STAGES[0][1]
+    for threshold, name in STAGES:
+        if progress >= threshold:
+            stage = name
+    return stage
+
+
+class Job:
+    """State of one submission: its scratch directory, progress and outcome."""
+
+    def __init__(self, gene_ids):
+        self.id = uuid.uuid4().hex[:12]
+        self.gene_ids = gene_ids
+        self.workdir = os.path.join(JOBS_DIR, self.id)
+        self.state = "queued"
+        self.progress = 0
+        self.stage = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.stage_times = {"queued": self.created}
+        # Place in the FlashFry admission queue while the job waits for a slot
+        self.flashfry_position = 0
+        # Bumped on every change so viewers can wait for the next one instead of polling
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def set_progress(self, progress, stage=None):
+        self.progress = progress
+        stage = stage or stage_for(progress)
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_times[stage] = time.time()
+            self.flashfry_position = 0
+        self.notify()
+
+    def set_waiting(self, position):
+        self.flashfry_position = position
+        self.notify()
+
+    def notify(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, since, timeout):
+        """Block until the job changes after version `since` or timeout elapses; returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > since, timeout)
+            return self.version
+
+    @property
+    def is_finished(self):
+        return self.state in ("done", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "gene_ids": self.gene_ids,
+            "state": self.state,
+            "progress": self.progress,
+            "stage": self.stage,
+            "stage_times": self.stage_times,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "version": self.version,
+            "flashfry_position": self.flashfry_position,
+        }
+
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when MAX_QUEUED_JOBS jobs are already waiting."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool, each in its own scratch directory, and expires old ones."""
+
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, ttl=JOB_TTL, cleanup_interval=600, max_queued=MAX_QUEUED_JOBS):
+        self.jobs = {}
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crispr-job")
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        threading.Thread(target=self._cleanup_loop, args=(cleanup_interval,), daemon=True).start()
+
+    def submit(self, gene_ids, runner):
+        job = Job(gene_ids)
+        with self._lock:
+            queued = sum(j.state == "queued" for j in self.jobs.values())
+            if queued >= self.max_queued:
+                raise QueueFull(self._retry_after())
+            self.jobs[job.id] = job
+        os.makedirs(job.workdir, exist_ok=True)
+        self._executor.submit(self._run, job, runner)
+        return job
+
+    def add_finished(self, gene_ids):
+        """Register a job whose results are already available, e.g. restored from the result cache."""
+        job = Job(gene_ids)
+        os.makedirs(job.workdir, exist_ok=True)
+        job.state = "done"
+        job.started = job.finished = time.time()
+        job.set_progress(100)
+        with self._lock:
+            self.jobs[job.id] = job
+        return job
+
+    def discard(self, job):
+        """Forget a job and remove its directory, e.g. one add_finished could not fill."""
+        with self._lock:
+            self.jobs.pop(job.id, None)
+        shutil.rmtree(job.workdir, ignore_errors=True)
+
+    def _run(self, job, runner):
+        # Under the lock so queue_position never sees a job leave the queue halfway through
+        with self._lock:
+            job.state = "running"
+            job.started = time.time()
+        job.notify()
+        try:
+            runner(job)
+            job.state = "done" if job.error is None else "failed"
+        except Exception as e:
+            job.error = str(e)
+            job.state = "failed"
+        job.finished = time.time()
+        if job.state == "done":
+            job.set_progress(100)
+        else:
+            job.notify()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def queue_position(self, job):
+        """1-based position among queued jobs, or 0 once the job has started."""
+        with self._lock:
+            if job.state != "queued":
+                return 0
+            queued = sorted((j for j in self.jobs.values() if j.state == "queued"), key=lambda j: j.created)
+        return next((i for i, j in enumerate(queued, 1) if j.id == job.id), 0)
+
+    def _retry_after(self, default=60):
+        """Seconds until a queue slot is likely to free up, from the run time of recent jobs."""
+        recent = sorted((j for j in self.jobs.values() if j.finished and j.started), key=lambda j: j.finished)[-20:]
+        mean = sum(j.finished - j.started for j in recent) / len(recent) if recent else default
+        # A queue place frees up when the next running job ends and the head of the queue starts
+        return max(1, int(mean / self.max_workers + 0.5))
+
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job for job in self.jobs.values() if job.finished and job.finished < cutoff]
+            for job in expired:
+                del self.jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.workdir, ignore_errors=True)
+        return len(expired)
+
+    def _cleanup_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            removed = self.cleanup()
+            if removed:
+                print(f"Removed {removed} expired job(s)")
@@ -0,0 +1,230 @@
+"""Genome-scale library design: guides and donors for a gene list, sharded across a process pool.
+
+    python library.py genes.txt library_out --workers 8
+
+Each shard of genes is one in-process pipeline run in its own working directory. Finished
+shards write their rows to part files and every gene is then appended to checkpoint.jsonl,
+so a rerun with the same output directory skips the genes already recorded there. When all
+shards are done the parts are consolidated into guides.parquet and donors.parquet.
+"""
+import os, sys, json, time, shutil, hashlib, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from crispr_webtooltest import split_gene_ids
+from guide_store import store_result
+import flashfry_worker
+from flashfry_worker import admission_slots, FlashFryAdmission, FLASHFRY_SOCKET
+
+# Pipeline processes; 0 means one per CPU, capped at the FlashFry slots the memory budget allows
+LIBRARY_WORKERS = int(os.environ.get("CRISPR_LIBRARY_WORKERS", 0))
+# Genes per pipeline run; larger shards amortize each FlashFry pass over more windows
+LIBRARY_SHARD_SIZE = int(os.environ.get("CRISPR_LIBRARY_SHARD_SIZE", 25))
+LIBRARY_FORMAT = os.environ.get("CRISPR_LIBRARY_FORMAT", "parquet")
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+PARTS_DIR = "parts"
+WORK_DIR = "work"
+# Checkpoint states that are final; failed genes are retried on the next run
+FINISHED = ("done", "unresolved")
+DONOR_COLUMNS = ["gene", "rank", "target", "orientation", "distance_from_exon",
+                 "left_ai1", "right_ai1", "left_arm", "right_arm", "error"]
+
+
+def read_gene_list(path):
+    with open(path) as gene_file:
+        genes = [gene for line in gene_file for gene in split_gene_ids(line)]
+    # Keep the first occurrence of each gene, in file order
+    return list(dict.fromkeys(genes))
+
+
+# Function to read the checkpoint; the last record of a gene wins
+def read_checkpoint(out_dir):
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    records = {}
+    if os.path.exists(path):
+        with open(path) as checkpoint:
+            for line in checkpoint:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                records[record["gene"]] = record
+    return records
+
+
+def append_checkpoint(out_dir, records):
+    with open(os.path.join(out_dir, CHECKPOINT_FILE), "a") as checkpoint:
+        for record in records:
+            checkpoint.write(json.dumps(record) + "\n")
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+
+def shard_name(genes):
+    return "shard-" + hashlib.sha1(",".join(genes).encode()).hexdigest()[:12]
+
+
+def write_table(df, path, fmt):
+    if fmt == "parquet":
+        df.to_parquet(path + ".parquet", index=False)
+    else:
+        df.to_csv(path + ".csv.gz", index=False)
+
+
+def read_table(path, fmt):
+    if fmt == "parquet":
+        return pd.read_parquet(path + ".parquet")
+    return pd.read_csv(path + ".csv.gz", keep_default_na=False, na_values=[""])
+
+
+# Function to pick the pool size so the workers' FlashFry JVMs together fit one memory budget
+def library_workers(workers=LIBRARY_WORKERS):
+    cpus = os.cpu_count() or 1
+    if os.path.exists(FLASHFRY_SOCKET):
+        # Runs go through the shared service, whose fixed pool of JVMs already holds the heap
+        return workers if workers > 0 else cpus
+    slots = admission_slots()
+    if workers <= 0:
+        return min(cpus, slots)
+    if workers > slots:
+        print(f"Capping {workers} workers at {slots}: each one may start a cold FlashFry JVM")
+    return min(workers, slots)
+
+
+# Function to give each pool process one FlashFry slot of the parent's budget
+def _init_worker():
+    flashfry_worker._admission = FlashFryAdmission(1)
+
+
+# Function to run one shard in a pool worker and write its part files
+def design_shard(genes, out_dir, fmt, keep_work=False, export=False):
+    from pipeline import run_job, NoTargetsError
+
+    name = shard_name(genes)
+    workdir = os.path.join(out_dir, WORK_DIR, name)
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        job = run_job(genes, workdir=workdir, progress=lambda stage, percent: None, on_wait=lambda position: None)
+    except NoTargetsError as e:
+        # No gene of the shard had a last exon or an NGG site; any other error is retried on the next run
+        return [{"gene": gene, "status": "unresolved", "error": str(e)} for gene in genes]
+    except Exception as e:
+        return [{"gene": gene, "status": "failed", "error": str(e)} for gene in genes]
+    guides, donors = [], []
+    for gene, result in job.results.items():
+        table = result.table.reset_index(drop=True)
+        table.insert(0, "gene", gene)
+        table.insert(1, "rank", range(len(table)))
+        guides.append(table)
+        for rank, design in enumerate(result.donors):
+            donors.append({**design, "gene": gene, "rank": rank})
+    if guides:
+        write_table(pd.concat(guides, ignore_index=True), os.path.join(out_dir, PARTS_DIR, f"guides-{name}"), fmt)
+        write_table(pd.DataFrame(donors).reindex(columns=DONOR_COLUMNS),
+                    os.path.join(out_dir, PARTS_DIR, f"donors-{name}"), fmt)
+    records = [{"gene": gene, "status": "done", "part": name} for gene in job.results]
+    if export:
+        # The files persist wrote, for the parent to load into the guide store
+        for record in records:
+            result = job.results[record["gene"]]
+            with open(result.csv_path) as table_file:
+                record["result"] = (table_file.read(), result.variables, result.donors)
+    if not keep_work:
+        shutil.rmtree(workdir, ignore_errors=True)
+    # Genes ranking dropped for lack of scored guides are in neither results nor unresolved; genes
+    # that hit a lookup error are retried on the next run
+    return records + [{"gene": gene, "status": "failed", "error": job.errors[gene]} if gene in job.errors
+                      else {"gene": gene, "status": "unresolved"} for gene in genes if gene not in job.results]
+
+
+# Function to merge the part files named in the checkpoint into one guides and one donors table
+def consolidate(out_dir, fmt):
+    records = read_checkpoint(out_dir)
+    parts = {}
+    for record in records.values():
+        if record["status"] == "done":
+            parts.setdefault(record["part"], set()).add(record["gene"])
+    for kind in ("guides", "donors"):
+        frames = []
+        for name, genes in sorted(parts.items()):
+            df = read_table(os.path.join(out_dir, PARTS_DIR, f"{kind}-{name}"), fmt)
+            # A part rewritten by an interrupted run may hold genes the checkpoint credits elsewhere
+            frames.append(df[df["gene"].isin(genes)])
+        if frames:
+            write_table(pd.concat(frames, ignore_index=True), os.path.join(out_dir, kind), fmt)
+    return records
+
+
+def check_format(fmt):
+    if fmt == "parquet":
+        try:
+            pd.io.parquet.get_engine("auto")
+        except ImportError as e:
+            raise ImportError(f"{e}\nInstall pyarrow for Parquet output, or pass --format csv") from None
+    elif fmt != "csv":
+        raise ValueError(f"Unknown library format {fmt}")
+
+
+def run_library(genes, out_dir, workers=LIBRARY_WORKERS, shard_size=LIBRARY_SHARD_SIZE, fmt=LIBRARY_FORMAT,
+                keep_work=False, store=None):
+    """Design every gene not yet in the checkpoint; with a GuideStore, finished genes are also loaded into it."""
+    check_format(fmt)
+    workers = library_workers(workers)
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(os.path.join(out_dir, PARTS_DIR), exist_ok=True)
+    checkpoint = read_checkpoint(out_dir)
+    finished = {gene for gene, record in checkpoint.items() if record["status"] in FINISHED}
+    if store is not None:
+        # Genes designed by an earlier run without the store, or under other settings, are redone
+        finished = {gene for gene in finished if checkpoint[gene]["status"] != "done" or store.has(gene)}
+    pending = [gene for gene in genes if gene not in finished]
+    shards = [pending[i:i + shard_size] for i in range(0, len(pending), shard_size)]
+    print(f"{len(genes)} genes: {len(genes) - len(pending)} already done, {len(pending)} to design "
+          f"in {len(shards)} shard(s) on {workers} worker(s)")
+
+    started = time.perf_counter()
+    completed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(design_shard, shard, out_dir, fmt, keep_work, store is not None) for shard in shards]
+        for future in as_completed(futures):
+            records = future.result()
+            for record in records:
+                if "result" in record:
+                    store_result(store, record["gene"], *record.pop("result"))
+            append_checkpoint(out_dir, records)
+            completed += len(records)
+            failed = sum(record["status"] == "failed" for record in records)
+            elapsed = time.perf_counter() - started
+            rate = completed / elapsed * 60
+            remaining = (len(pending) - completed) / rate if rate else 0
+            print(f"{completed}/{len(pending)} genes, {rate:.1f} genes/min, "
+                  f"{failed} failed in this shard, ~{remaining:.1f} min left", flush=True)
+
+    records = consolidate(out_dir, fmt)
+    states = {}
+    for gene in genes:
+        status = records.get(gene, {}).get("status", "missing")
+        states[status] = states.get(status, 0) + 1
+    print(f"Library written to {out_dir}: " + ", ".join(f"{count} {status}" for status, count in sorted(states.items())))
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Design guides and donors for a gene list")
+    parser.add_argument("genes", help="file with one gene (or comma-separated genes) per line")
+    parser.add_argument("out_dir", help="output directory; rerunning with it resumes from its checkpoint")
+    parser.add_argument("--workers", type=int, default=LIBRARY_WORKERS,
+                        help="pipeline processes (default: CPUs, capped at the FlashFry memory budget)")
+    parser.add_argument("--shard-size", type=int, default=LIBRARY_SHARD_SIZE, help="genes per pipeline run")
+    parser.add_argument("--format", default=LIBRARY_FORMAT, choices=("parquet", "csv"), help="output format")
+    parser.add_argument("--keep-work", action="store_true", help="keep each shard's working directory")
+    options = parser.parse_args()
+    try:
+        run_library(read_gene_list(options.genes), options.out_dir, options.workers, options.shard_size,
+                    options.format, options.keep_work)
+    except (ImportError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,94 @@
+import os, json, time, sqlite3, threading
+
+# On-disk cache for UniProt ID mappings and EBI protein coordinates
+CACHE_PATH = os.environ.get("CRISPR_LOOKUP_CACHE", "lookup_cache.sqlite3")
+CACHE_TTL = int(os.environ.get("CRISPR_LOOKUP_CACHE_TTL", 30 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get("CRISPR_LOOKUP_CACHE_MAX_ENTRIES", 50000))
+
+
+class LookupCache:
+    """SQLite-backed key/value cache with TTL expiry and LRU eviction."""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookups ("
+            " kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lookups_accessed ON lookups (accessed)")
+        self._conn.commit()
+
+    def get(self, kind, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM lookups WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if now - created > self.ttl:
+                self._conn.execute("DELETE FROM lookups WHERE kind = ? AND key = ?", (kind, key))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE lookups SET accessed = ? WHERE kind = ? AND key = ?", (now, kind, key)
+            )
+            self._conn.commit()
+        return json.loads(value)
+
+    def put(self, kind, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lookups (kind, key, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(value), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM lookups").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM lookups WHERE rowid IN (SELECT rowid FROM lookups ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM lookups WHERE created < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+
+    # (gene symbol, source DB, target DB) -> list of accessions
+    def get_id_mapping(self, gene, from_db, to_db):
+        return self.get("id_mapping", f"{gene.strip().upper()}|{from_db}|{to_db}")
+
+    def put_id_mapping(self, gene, from_db, to_db, accessions):
+        self.put("id_mapping", f"{gene.strip().upper()}|{from_db}|{to_db}", accessions)
+
+    # accession -> EBI coordinates JSON
+    def get_coordinates(self, accession):
+        return self.get("coordinates", accession)
+
+    def put_coordinates(self, accession, response_data):
+        self.put("coordinates", accession, response_data)
+
+
+_cache = None
+
+
+# Function to open the shared lookup cache once per process
+def get_lookup_cache():
+    global _cache
+    if _cache is None:
+        _cache = LookupCache()
+    return _cache
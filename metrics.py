@@ -0,0 +1,130 @@
+import os, json, time, threading, contextvars
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Per-job timing record written into the job's working directory
+TIMINGS_FILE = "timings.json"
+
+
+class Span:
+    """One timed stage: wall time, bytes transferred and whether it raised."""
+
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.started = time.time()
+        self.seconds = 0.0
+        self.bytes = 0
+        self.outcome = "ok"
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+    def to_dict(self):
+        return {"stage": self.stage, "started": self.started, "seconds": round(self.seconds, 6),
+                "bytes": self.bytes, "outcome": self.outcome, **self.labels}
+
+
+class Metrics:
+    """Process-wide stage histograms and counters, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._outcomes = {}
+        self._bytes = {}
+
+    def observe(self, span):
+        with self._lock:
+            counts = self._durations.setdefault(span.stage, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if span.seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += span.seconds
+            counts[-1] += 1
+            key = (span.stage, span.outcome)
+            self._outcomes[key] = self._outcomes.get(key, 0) + 1
+            self._bytes[span.stage] = self._bytes.get(span.stage, 0) + span.bytes
+
+    def render(self):
+        lines = [
+            "# HELP crispr_stage_duration_seconds Wall time of each pipeline stage.",
+            "# TYPE crispr_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, counts in sorted(self._durations.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'crispr_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'crispr_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'crispr_stage_duration_seconds_sum{{stage="{stage}"}} {counts[-2]:.6f}')
+                lines.append(f'crispr_stage_duration_seconds_count{{stage="{stage}"}} {counts[-1]}')
+            lines += ["# HELP crispr_stage_total Completed stages by outcome.", "# TYPE crispr_stage_total counter"]
+            for (stage, outcome), count in sorted(self._outcomes.items()):
+                lines.append(f'crispr_stage_total{{stage="{stage}",outcome="{outcome}"}} {count}')
+            lines += ["# HELP crispr_stage_bytes_total Bytes transferred or written by each stage.",
+                      "# TYPE crispr_stage_bytes_total counter"]
+            for stage, count in sorted(self._bytes.items()):
+                lines.append(f'crispr_stage_bytes_total{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+# Spans of the job running in the current context; asyncio.to_thread copies it into worker threads
+_current_trace = contextvars.ContextVar("crispr_trace", default=None)
+# Innermost open span, so shared code such as http_client can attribute bytes to it
+_current_span = contextvars.ContextVar("crispr_span", default=None)
+
+
+def get_metrics():
+    return _metrics
+
+
+# Function to count bytes against the innermost open stage, if any
+def add_bytes(count):
+    span = _current_span.get()
+    if span is not None:
+        span.add_bytes(count)
+
+
+# Function to time one stage, feeding the process histograms and the current job's trace
+@contextmanager
+def stage(name, **labels):
+    span = Span(name, **labels)
+    token = _current_span.set(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.outcome = "error"
+        raise
+    finally:
+        span.seconds = time.perf_counter() - started
+        _current_span.reset(token)
+        _metrics.observe(span)
+        trace = _current_trace.get()
+        if trace is not None:
+            with trace["lock"]:
+                trace["spans"].append(span.to_dict())
+
+
+# Function to collect every stage of one job and write them to workdir/timings.json when it ends
+@contextmanager
+def trace_job(workdir, **fields):
+    trace = {"lock": threading.Lock(), "spans": []}
+    token = _current_trace.set(trace)
+    started = time.time()
+    outcome = "ok"
+    try:
+        yield trace
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        record = {**fields, "started": started, "seconds": round(time.time() - started, 6), "outcome": outcome,
+                  "spans": sorted(trace["spans"], key=lambda span: span["started"])}
+        with open(os.path.join(workdir, TIMINGS_FILE), "w") as timings_file:
+            json.dump(record, timings_file, indent=2)
+
@@ -0,0 +1,285 @@
+import os, sys, mmap, struct, zlib, threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from flashfry_worker import FLASHFRY_DATABASE
+from pam_discovery import SPACER_LENGTH, SITE_LENGTH
+
+# Unpacked, directly memory-mappable copy of the FlashFry database written by `unpack`
+OFFTARGET_INDEX = os.environ.get("CRISPR_OFFTARGET_INDEX", "offtarget_index")
+# Decompressed bins kept in memory when reading the BGZF database directly
+OFFTARGET_BIN_CACHE = int(os.environ.get("CRISPR_OFFTARGET_BIN_CACHE", 64))
+OFFTARGET_MAX_MISMATCHES = int(os.environ.get("CRISPR_OFFTARGET_MISMATCHES", 4))
+
+# Bins are keyed by the first 7 bases of each target
+PREFIX_LENGTH = 7
+# Target words: 2 bits per base (A=0, C=1, G=2, T=3) above a 16-bit occurrence count
+COUNT_BITS = 16
+COUNT_MASK = (1 << COUNT_BITS) - 1
+# Position words: contig index, 0-based position, target length and a forward-strand bit
+POSITION_CONTIG_SHIFT = 40
+POSITION_SHIFT = 8
+POSITION_MASK = 0xFFFFFFFF
+POSITION_SIZE_SHIFT = 1
+POSITION_SIZE_MASK = 0x7F
+
+UNPACKED_FILES = ("targets", "bin_starts", "positions", "position_starts")
+
+_BASE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+_BASES = "ACGT"
+# Low bit of every 2-bit base slot, used to count mismatched bases after folding
+_LOW_BITS = np.uint64(int("01" * 32, 2))
+_SPACER_MASK = np.uint64(((1 << (2 * SPACER_LENGTH)) - 1) << (COUNT_BITS + 2 * (SITE_LENGTH - SPACER_LENGTH)))
+_PREFIX_SHIFT = COUNT_BITS + 2 * (SITE_LENGTH - PREFIX_LENGTH)
+
+
+@dataclass
+class DatabaseHeader:
+    """Parsed `<database>.header`: bin table as arrays plus the contig names positions refer to."""
+    magic: int
+    version: int
+    parameter: int
+    offsets: np.ndarray
+    sizes: np.ndarray
+    counts: np.ndarray
+    contigs: Dict[int, str] = field(default_factory=dict)
+
+
+# Function to parse the FlashFry database header into NumPy arrays indexed by bin
+def read_header(header_path):
+    with open(header_path) as header_file:
+        lines = [line.strip() for line in header_file if line.strip()]
+    magic, version, parameter, bin_count = (int(value) for value in lines[:4])
+    offsets = np.empty(bin_count, dtype=np.uint64)
+    sizes = np.empty(bin_count, dtype=np.int64)
+    counts = np.empty(bin_count, dtype=np.int64)
+    for row, line in enumerate(lines[4:4 + bin_count]):
+        prefix, values = line.split("=")
+        if encode_prefix(prefix) != row:
+            raise ValueError(f"{header_path}: bin {row} is {prefix}, expected bins in ACGT order")
+        offset, size, count = values.split(",")
+        offsets[row], sizes[row], counts[row] = int(offset), int(size), int(count)
+    contigs = {}
+    for line in lines[4 + bin_count:]:
+        name, index = line.rsplit("=", 1)
+        # Names are whole Ensembl FASTA headers with spaces as underscores; keep the sequence name
+        contigs[int(index)] = name.split("_dna:")[0]
+    return DatabaseHeader(magic, version, parameter, offsets, sizes, counts, contigs)
+
+
+def encode_prefix(prefix):
+    code = 0
+    for base in prefix:
+        code = code << 2 | _BASE_CODES[base]
+    return code
+
+
+# Function to pack 23-mer targets into the database's 64-bit word layout
+def encode_targets(targets):
+    words = np.empty(len(targets), dtype=np.uint64)
+    for i, target in enumerate(targets):
+        target = target.upper()
+        if len(target) != SITE_LENGTH:
+            raise ValueError(f"Expected a {SITE_LENGTH} bp target with PAM, got {target}")
+        words[i] = encode_prefix(target) << COUNT_BITS
+    return words
+
+
+def decode_target(word):
+    word = int(word) >> COUNT_BITS
+    return "".join(_BASES[(word >> 2 * (SITE_LENGTH - 1 - i)) & 3] for i in range(SITE_LENGTH))
+
+
+# Function to count mismatched spacer bases between every target and every guide, via XOR and popcount
+def count_mismatches(targets, guides, mask=_SPACER_MASK):
+    diff = (targets[:, None] ^ guides[None, :]) & mask
+    diff = (diff | (diff >> np.uint64(1))) & _LOW_BITS
+    return _popcount(diff)
+
+
+def _popcount(words):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    bits = np.unpackbits(words.view(np.uint8).reshape(*words.shape, 8), axis=-1)
+    return bits.sum(axis=-1, dtype=np.uint8)
+
+
+# Function to split a bin's word block into target words and the index of each target's first position word
+def parse_block(words):
+    targets = []
+    starts = []
+    values = words.tolist()
+    i = 0
+    while i < len(values):
+        targets.append(values[i])
+        starts.append(i + 1)
+        i += 1 + (values[i] & COUNT_MASK)
+    return np.array(targets, dtype=np.uint64), np.array(starts, dtype=np.int64)
+
+
+class OffTargetDatabase:
+    """Off-target lookups against FlashFry's binned database without a JVM.
+
+    Reads the unpacked .npy copy through shared memory maps when it exists, otherwise decompresses
+    bins from the BGZF database on demand and keeps the most recent ones in an LRU.
+    """
+
+    def __init__(self, database=FLASHFRY_DATABASE, index_dir=OFFTARGET_INDEX, cache_size=OFFTARGET_BIN_CACHE):
+        self.database = database
+        self.header = read_header(database + ".header")
+        self.index_dir = index_dir
+        self.cache_size = cache_size
+        self._bins = OrderedDict()
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._mmap = None
+        if all(os.path.exists(os.path.join(index_dir, f"{name}.npy")) for name in UNPACKED_FILES):
+            self._arrays = {
+                name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r") for name in UNPACKED_FILES
+            }
+        else:
+            self._file = open(database, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_bgzf(self, virtual_offset, size):
+        # Virtual offsets hold the compressed block start in the upper 48 bits, the offset inside it below
+        compressed, within = int(virtual_offset) >> 16, int(virtual_offset) & 0xFFFF
+        chunks = []
+        remaining = size + within
+        while remaining > 0 and compressed < len(self._mmap):
+            block_size = struct.unpack_from("<H", self._mmap, compressed + 16)[0] + 1
+            payload = zlib.decompress(self._mmap[compressed + 18:compressed + block_size - 8], -15)
+            chunks.append(payload)
+            remaining -= len(payload)
+            compressed += block_size
+        return b"".join(chunks)[within:within + size]
+
+    def bin(self, index):
+        """Return (targets, position_starts, position_words) for one prefix bin."""
+        if self._arrays is not None:
+            arrays = self._arrays
+            lo, hi = arrays["bin_starts"][index], arrays["bin_starts"][index + 1]
+            starts = arrays["position_starts"][lo:hi + 1]
+            return arrays["targets"][lo:hi], starts[:-1], arrays["positions"]
+        with self._lock:
+            if index in self._bins:
+                self._bins.move_to_end(index)
+                return self._bins[index]
+        raw = self._read_bgzf(self.header.offsets[index], int(self.header.sizes[index]))
+        # FlashFry writes Java longs, big-endian
+        words = np.frombuffer(raw, dtype=">u8").astype(np.uint64)
+        targets, starts = parse_block(words)
+        entry = (targets, starts, words)
+        with self._lock:
+            self._bins[index] = entry
+            while len(self._bins) > self.cache_size:
+                self._bins.popitem(last=False)
+        return entry
+
+    def candidate_bins(self, guide_words, max_mismatches):
+        """Boolean (bins, guides) matrix of bins whose 7-mer prefix is within the mismatch budget."""
+        prefixes = np.arange(len(self.header.counts), dtype=np.uint64) << np.uint64(_PREFIX_SHIFT)
+        prefix_mask = np.uint64(((1 << 2 * PREFIX_LENGTH) - 1) << _PREFIX_SHIFT)
+        within = count_mismatches(prefixes, guide_words, prefix_mask) <= max_mismatches
+        return within & (self.header.counts > 0)[:, None]
+
+    def search(self, guides, max_mismatches=OFFTARGET_MAX_MISMATCHES, with_positions=False, chunk=1 << 16):
+        """Find every database target within max_mismatches spacer mismatches of each 23-mer guide."""
+        guides = [guide.upper() for guide in guides]
+        guide_words = encode_targets(guides)
+        candidates = self.candidate_bins(guide_words, max_mismatches)
+        hits = []
+        for index in np.flatnonzero(candidates.any(axis=1)):
+            columns = np.flatnonzero(candidates[index])
+            targets, starts, positions = self.bin(index)
+            for lo in range(0, len(targets), chunk):
+                mismatches = count_mismatches(targets[lo:lo + chunk], guide_words[columns])
+                rows, cols = np.nonzero(mismatches <= max_mismatches)
+                for row, col in zip(rows.tolist(), cols.tolist()):
+                    word = int(targets[lo + row])
+                    hit = {
+                        "guide": guides[columns[col]],
+                        "off_target": decode_target(word),
+                        "mismatches": int(mismatches[row, col]),
+                        "occurrences": word & COUNT_MASK,
+                    }
+                    if with_positions:
+                        first = int(starts[lo + row])
+                        hit["positions"] = self.decode_positions(positions[first:first + hit["occurrences"]])
+                    hits.append(hit)
+        return pd.DataFrame(hits, columns=["guide", "off_target", "mismatches", "occurrences"]
+                            + (["positions"] if with_positions else []))
+
+    def decode_positions(self, words):
+        words = np.asarray(words, dtype=np.uint64)
+        contigs = (words >> np.uint64(POSITION_CONTIG_SHIFT)).tolist()
+        positions = ((words >> np.uint64(POSITION_SHIFT)) & np.uint64(POSITION_MASK)).tolist()
+        forward = (words & np.uint64(1)).astype(bool).tolist()
+        return [(self.header.contigs.get(contig, str(contig)), position, "FWD" if strand else "RVS")
+                for contig, position, strand in zip(contigs, positions, forward)]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+
+
+# Function to rewrite the BGZF database as flat .npy arrays that worker processes can memory-map
+def unpack(database=FLASHFRY_DATABASE, out_dir=OFFTARGET_INDEX):
+    source = OffTargetDatabase(database, index_dir=os.devnull, cache_size=0)
+    header = source.header
+    total_targets = int(header.counts.sum())
+    total_positions = int((header.sizes // 8).sum()) - total_targets
+    os.makedirs(out_dir, exist_ok=True)
+    open_memmap = np.lib.format.open_memmap
+    targets = open_memmap(os.path.join(out_dir, "targets.npy"), mode="w+", dtype=np.uint64, shape=(total_targets,))
+    positions = open_memmap(os.path.join(out_dir, "positions.npy"), mode="w+", dtype=np.uint64, shape=(total_positions,))
+    position_starts = open_memmap(os.path.join(out_dir, "position_starts.npy"), mode="w+", dtype=np.int64,
+                                  shape=(total_targets + 1,))
+    bin_starts = np.zeros(len(header.counts) + 1, dtype=np.int64)
+    target_row = position_row = 0
+    for index in range(len(header.counts)):
+        bin_targets, starts, words = source.bin(index)
+        is_position = np.ones(len(words), dtype=bool)
+        is_position[starts - 1] = False
+        targets[target_row:target_row + len(bin_targets)] = bin_targets
+        # Each target's positions follow it directly, so its first position is its start minus the targets before it
+        position_starts[target_row:target_row + len(bin_targets)] = position_row + starts - np.arange(1, len(starts) + 1)
+        positions[position_row:position_row + is_position.sum()] = words[is_position]
+        target_row += len(bin_targets)
+        position_row += int(is_position.sum())
+        bin_starts[index + 1] = target_row
+        if index % 1024 == 0:
+            print(f"Unpacked {index}/{len(header.counts)} bins", flush=True)
+    position_starts[target_row] = position_row
+    np.save(os.path.join(out_dir, "bin_starts.npy"), bin_starts)
+    for array in (targets, positions, position_starts):
+        array.flush()
+    source.close()
+    print(f"Unpacked {target_row} targets and {position_row} positions into {out_dir}")
+
+
+_database = None
+
+
+# Function to open the shared off-target database once per process
+def get_offtarget_database():
+    global _database
+    if _database is None:
+        _database = OffTargetDatabase()
+    return _database
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "unpack":
+        unpack(*sys.argv[2:4])
+    elif len(sys.argv) > 2 and sys.argv[1] == "search":
+        mismatches = int(sys.argv[3]) if len(sys.argv) > 3 else OFFTARGET_MAX_MISMATCHES
+        print(get_offtarget_database().search(sys.argv[2].split(","), mismatches).to_string(index=False))
+    else:
+        print("Usage: python offtarget_db.py unpack [database] [out_dir]\n"
+              "       python offtarget_db.py search GUIDE[,GUIDE...] [mismatches]")
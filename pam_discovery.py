@@ -0,0 +1,123 @@
+import sys, time
+import numpy as np
+import pandas as pd
+
+from sequence_utils import reverse_complement
+
+# SpCas9 protospacer layout: 20 bp spacer followed by an NGG PAM
+SPACER_LENGTH = 20
+PAM_LENGTH = 3
+SITE_LENGTH = SPACER_LENGTH + PAM_LENGTH
+# Flanking bases FlashFry includes in the Doench 2014 30-mer context
+CONTEXT_BEFORE = 4
+CONTEXT_AFTER = 3
+
+DISCOVER_COLUMNS = ['contig', 'start', 'stop', 'target', 'context', 'overflow', 'orientation']
+
+_A, _C, _G, _T = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+# Function to find the start of every 23 bp window containing only A/C/G/T
+def _clean_windows(codes):
+    valid = np.isin(codes, (_A, _C, _G, _T)).astype(np.int32)
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    return (counts[SITE_LENGTH:] - counts[:-SITE_LENGTH]) == SITE_LENGTH
+
+
+# Function to locate forward (..NGG) and reverse (CCN..) site starts in a uint8-encoded sequence
+def _site_starts(codes):
+    if len(codes) < SITE_LENGTH:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    clean = _clean_windows(codes)
+    n = len(clean)
+    starts = np.arange(n)
+    fwd = clean & (codes[SITE_LENGTH - 2:SITE_LENGTH - 2 + n] == _G) & (codes[SITE_LENGTH - 1:] == _G)
+    rvs = clean & (codes[:n] == _C) & (codes[1:n + 1] == _C)
+    return starts[fwd], starts[rvs]
+
+
+# Function to list every NGG protospacer on both strands of one sequence, as FlashFry discover reports them
+def find_protospacers(seq, contig="sequence"):
+    seq = seq.upper()
+    fwd, rvs = _site_starts(np.frombuffer(seq.encode(), dtype=np.uint8))
+    starts = np.concatenate((fwd, rvs))
+    forward = np.concatenate((np.ones(len(fwd), bool), np.zeros(len(rvs), bool)))
+    order = np.lexsort((~forward, starts))
+    starts, forward = starts[order], forward[order]
+
+    targets, contexts = [], []
+    for start, is_fwd in zip(starts.tolist(), forward.tolist()):
+        # The 30-mer context extends 4 bp 5' and 3 bp 3' of the site on the target's own strand
+        if is_fwd:
+            lo, hi = start - CONTEXT_BEFORE, start + SITE_LENGTH + CONTEXT_AFTER
+        else:
+            lo, hi = start - CONTEXT_AFTER, start + SITE_LENGTH + CONTEXT_BEFORE
+        site = seq[start:start + SITE_LENGTH]
+        context = seq[lo:hi] if lo >= 0 and hi <= len(seq) else ""
+        if not is_fwd:
+            site = reverse_complement(site)
+            context = reverse_complement(context)
+        targets.append(site)
+        contexts.append(context)
+    return pd.DataFrame({
+        'contig': contig,
+        'start': starts,
+        'stop': starts + SITE_LENGTH,
+        'target': targets,
+        'context': contexts,
+        'overflow': 'OK',
+        'orientation': np.where(forward, 'FWD', 'RVS'),
+    }, columns=DISCOVER_COLUMNS)
+
+
+# Function to count protospacers on both strands without building the table
+def count_protospacers(seq):
+    fwd, rvs = _site_starts(np.frombuffer(seq.upper().encode(), dtype=np.uint8))
+    return len(fwd) + len(rvs)
+
+
+def read_fasta(path):
+    records = {}
+    name = None
+    with open(path) as fasta:
+        for line in fasta:
+            line = line.strip()
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+                records[name] = []
+            elif name is not None:
+                records[name].append(line)
+    return {name: ''.join(parts) for name, parts in records.items()}
+
+
+# Function to discover protospacers for every record of a FASTA file
+def discover_fasta(path):
+    frames = [find_protospacers(seq, name) for name, seq in read_fasta(path).items()]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=DISCOVER_COLUMNS)
+
+
+# Function to compare native discovery with a FlashFry discover output on the same FASTA
+def compare_with_flashfry(fasta_path, flashfry_output):
+    started = time.perf_counter()
+    native = discover_fasta(fasta_path)
+    elapsed = time.perf_counter() - started
+    flashfry = pd.read_csv(flashfry_output, sep='\t')
+    key = ['contig', 'start', 'orientation', 'target']
+    native_sites = set(map(tuple, native[key].astype(str).values))
+    flashfry_sites = set(map(tuple, flashfry[key].astype(str).values))
+    print(f"Native discovery: {len(native_sites)} sites in {elapsed * 1000:.2f} ms")
+    print(f"FlashFry discover: {len(flashfry_sites)} sites")
+    for site in sorted(native_sites - flashfry_sites):
+        print("only native:  ", *site)
+    for site in sorted(flashfry_sites - native_sites):
+        print("only FlashFry:", *site)
+    return native_sites == flashfry_sites
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        sys.exit(0 if compare_with_flashfry(sys.argv[1], sys.argv[2]) else 1)
+    elif len(sys.argv) == 2:
+        print(discover_fasta(sys.argv[1]).to_csv(sep='\t', index=False), end='')
+    else:
+        print("Usage: python pam_discovery.py sequence.fa [CRISPRtg.output]")
@@ -0,0 +1,302 @@
+"""In-process CRISPR knock-in design pipeline.
+
+Each stage takes and returns plain typed values so it can be called from the CLI,
+the Flask server or a worker pool with libraries already imported:
+
+    resolve -> fetch -> discover -> score -> rank -> design -> persist
+
+Progress is reported through a ``progress(stage, percent)`` callback.
+"""
+import os, json
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from Bio.Seq import Seq
+
+import http_client
+from crispr_webtooltest import (
+    resolve_last_exons, design_windows, exon_distances, rank_targets, split_gene_ids, RESOLVE_WORKERS,
+    RANK_KEYS, RANK_ASCENDING, TOP_GUIDES,
+)
+from pam_discovery import count_protospacers
+from flashfry_worker import run_flashfry, get_admission, FLASHFRY_DATABASE, SCORING_METRICS
+from result_cache import get_result_cache, load_json
+from metrics import stage, trace_job
+from process_selected_row import design_donors
+
+ProgressCallback = Callable[[str, int], None]
+WaitCallback = Callable[[int], None]
+
+# File names inside a job's working directory
+FASTA_FILE = "sequence.fa"
+DISCOVER_OUTPUT = "CRISPRtg.output"
+SCORED_OUTPUT = "CRISPRtg.output.scored.tsv"
+
+# Columns of the scored TSV that ranking reads, with compact dtypes; everything else is skipped
+SCORED_DTYPES = {
+    'contig': 'category',
+    'start': 'int32',
+    'target': 'object',
+    'orientation': 'category',
+    'Doench2014OnTarget': 'float32',
+    'DoenchCFD_maxOT': 'float32',
+    'DoenchCFD_specificityscore': 'float32',
+    'Hsu2013': 'float32',
+    'Moreno-Mateos2015OnTarget': 'float32',
+}
+SCORED_CHUNKSIZE = int(os.environ.get("CRISPR_SCORED_CHUNKSIZE", 200_000))
+
+
+class NoTargetsError(ValueError):
+    """Raised by run_job when no gene has a last exon or an NGG site; rerunning will not change that."""
+
+
+@dataclass
+class GeneWindows:
+    """Sequence windows around one gene's last exon, all on the gene's strand."""
+    gene: str
+    last_exon_info: dict
+    gdna_sequence: str
+    last_exon_seq: str
+    search_sequence: str
+    exon_end_offset: int
+    amino_acid_seq: str = ""
+
+
+@dataclass
+class GeneResult:
+    """Ranked guides and donor-design inputs for one gene."""
+    gene: str
+    table: pd.DataFrame
+    variables: dict
+    csv_path: Optional[str] = None
+    donors: List[dict] = field(default_factory=list)
+
+
+@dataclass
+class JobResult:
+    genes: List[str]
+    results: Dict[str, GeneResult] = field(default_factory=dict)
+    unresolved: List[str] = field(default_factory=list)
+    # Why a gene failed to resolve or fetch, when it was an error rather than a miss
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+def print_progress(stage, percent):
+    """Default callback: the "Progress: N%" lines the server used to scrape from stdout."""
+    print(f"Progress: {percent}%", flush=True)
+
+
+def print_wait(position):
+    """Default callback for a job queued behind other FlashFry runs."""
+    print(f"Waiting for a FlashFry slot, position {position}", flush=True)
+
+
+def resolve(genes: List[str], max_workers: int = RESOLVE_WORKERS,
+            errors: Optional[Dict[str, str]] = None) -> Dict[str, dict]:
+    """Map each gene to its last_exon_info dict; unresolvable genes are left out, with lookup errors in errors."""
+    return resolve_last_exons(genes, max_workers, errors)
+
+
+def _translate_exon(exon_seq):
+    # Drop leading bases so the exon is a whole number of codons, then translate to the first stop
+    trimmed = exon_seq[len(exon_seq) % 3:]
+    return str(Seq(trimmed).translate(to_stop=True))
+
+
+def fetch(last_exons: Dict[str, dict], max_workers: int = RESOLVE_WORKERS,
+          errors: Optional[Dict[str, str]] = None) -> Dict[str, GeneWindows]:
+    """Fetch every gene's windows concurrently, one superset region per gene; failures go to errors."""
+    genes = list(last_exons)
+    windows = {}
+    fetched = http_client.run_concurrently(lambda gene: design_windows(last_exons[gene]), genes, max_workers, errors)
+    for gene, window in zip(genes, fetched):
+        if window:
+            windows[gene] = GeneWindows(
+                gene=gene,
+                last_exon_info=last_exons[gene],
+                gdna_sequence=window['gdna_sequence'],
+                last_exon_seq=window['last_exon_seq'],
+                search_sequence=window['search_sequence'],
+                exon_end_offset=window['exon_end_offset'],
+                amino_acid_seq=_translate_exon(window['last_exon_seq']),
+            )
+            print(f"{gene} last exon ({last_exons[gene]['exon_id']}) protein: {windows[gene].amino_acid_seq}")
+    return windows
+
+
+def discover(windows: Dict[str, GeneWindows], workdir: str = ".") -> str:
+    """Write one FASTA record per gene and run FlashFry discover once; returns the discover output path."""
+    fasta_file = os.path.join(workdir, FASTA_FILE)
+    with open(fasta_file, "w") as fa_file:
+        for gene, window in windows.items():
+            fa_file.write(f">{gene}_whole\n{window.search_sequence}\n")
+    discover_output = os.path.join(workdir, DISCOVER_OUTPUT)
+    with stage("flashfry_discover") as span:
+        run_flashfry(['discover', '--database', FLASHFRY_DATABASE, '--fasta', fasta_file, '--output', discover_output])
+        span.add_bytes(os.path.getsize(discover_output))
+    return discover_output
+
+
+def score(discover_output: str, workdir: str = ".") -> str:
+    """Run FlashFry score over the discovered guides; returns the scored TSV path."""
+    scored_output = os.path.join(workdir, SCORED_OUTPUT)
+    with stage("flashfry_score") as span:
+        run_flashfry(['score', '--input', discover_output, '--output', scored_output,
+                      '--scoringMetrics', SCORING_METRICS, '--database', FLASHFRY_DATABASE])
+        span.add_bytes(os.path.getsize(scored_output))
+    return scored_output
+
+
+class TopGuides:
+    """The best `k` guides seen so far for one gene under the ranking sort order.
+
+    Each chunk is merged with the kept rows and cut back to k, so memory is bounded by k plus one chunk.
+    Kept rows come before the chunk's rows, so ties resolve in file order as a full sort would.
+    """
+
+    def __init__(self, k=TOP_GUIDES):
+        self.k = k
+        self.rows = None
+
+    def push(self, df):
+        merged = df if self.rows is None else pd.concat([self.rows, df], ignore_index=True)
+        self.rows = merged.sort_values(by=RANK_KEYS, ascending=RANK_ASCENDING).head(self.k)
+
+    def result(self):
+        return self.rows
+
+
+# Function to stream the scored TSV in chunks, reading only the ranking columns
+def read_scored(scored_output, chunksize=SCORED_CHUNKSIZE):
+    return pd.read_csv(scored_output, sep='\t', usecols=list(SCORED_DTYPES), dtype=SCORED_DTYPES,
+                       chunksize=chunksize)
+
+
+def rank(scored_output: str, windows: Dict[str, GeneWindows], chunksize: int = SCORED_CHUNKSIZE) -> Dict[str, GeneResult]:
+    """Stream the scored table, add distances and keep each gene's top guides; contigs name the genes."""
+    with stage("rank") as span:
+        span.add_bytes(os.path.getsize(scored_output))
+        return _rank(scored_output, windows, chunksize)
+
+
+def _rank(scored_output, windows, chunksize):
+    top = {gene: TopGuides() for gene in windows}
+    for chunk in read_scored(scored_output, chunksize):
+        for contig, df in chunk.groupby('contig', observed=True):
+            gene = contig[:-len('_whole')] if contig.endswith('_whole') else contig
+            if gene not in windows:
+                continue
+            df = df.copy()
+            df['Distance from Exon'] = np.abs(exon_distances(df, windows[gene].search_sequence,
+                                                             windows[gene].exon_end_offset))
+            top[gene].push(df.dropna(subset=['Distance from Exon']))
+
+    results = {}
+    for gene, guides in top.items():
+        if guides.result() is None:
+            continue
+        window = windows[gene]
+        variables = {"gene_ids": gene, "last_exon_seq": window.last_exon_seq, "gdna_sequence": window.gdna_sequence}
+        results[gene] = GeneResult(gene=gene, table=rank_targets(guides.result()), variables=variables)
+    return results
+
+
+def design(results: Dict[str, GeneResult]) -> Dict[str, GeneResult]:
+    """Design the donors for every ranked guide up front, so selecting a row is a lookup."""
+    for result in results.values():
+        result.donors = design_donors(result.table, result.variables)
+    return results
+
+
+# Function to read a job's precomputed donor designs for one gene, in table row order, kept in memory until the file changes
+def load_donors(workdir, gene):
+    try:
+        return load_json(os.path.join(workdir, f'{gene}_donors.json'))
+    except FileNotFoundError:
+        return None
+
+
+def persist(results: Dict[str, GeneResult], workdir: str = ".") -> Dict[str, GeneResult]:
+    """Write each gene's table, variables and donors to workdir and store them in the result cache."""
+    for gene, result in results.items():
+        result.csv_path = os.path.join(workdir, f'{gene}_CRISPR_tgts.csv')
+        result.table.to_csv(result.csv_path, index=False)
+        with open(os.path.join(workdir, f'{gene}_variables.json'), 'w') as file:
+            json.dump(result.variables, file)
+        with open(os.path.join(workdir, f'{gene}_donors.json'), 'w') as file:
+            json.dump(result.donors, file)
+        try:
+            get_result_cache().store(gene, result.csv_path, result.variables, result.donors)
+        except OSError as e:
+            # The job's own files are written; a cache failure only costs a later rerun
+            print(f"Could not store {gene} in the result cache: {e}")
+        print(f"Filtered DataFrame saved to {result.csv_path}")
+    if len(results) == 1:
+        # Single-gene runs also keep the legacy variables.json for process_selected_row.py
+        with open(os.path.join(workdir, 'variables.json'), 'w') as file:
+            json.dump(next(iter(results.values())).variables, file)
+    return results
+
+
+def run_job(gene_ids, workdir: str = ".", progress: ProgressCallback = print_progress,
+            max_workers: int = RESOLVE_WORKERS, on_wait: WaitCallback = print_wait) -> JobResult:
+    """Run every stage for a comma-separated gene string (or list of genes) in workdir.
+
+    discover and score run under one FlashFry admission slot; while the job waits for it,
+    on_wait receives its position in the FIFO queue.
+    """
+    genes = split_gene_ids(gene_ids) if isinstance(gene_ids, str) else list(gene_ids)
+    with trace_job(workdir, genes=genes):
+        return _run_stages(genes, workdir, progress, max_workers, on_wait)
+
+
+# Function to end a job that has nothing left to design; lookup errors make it a failure rather than a miss
+def _no_targets(genes, errors, message):
+    if errors:
+        raise RuntimeError("Could not resolve " + "; ".join(
+            f"{gene}: {errors.get(gene, 'no last exon found')}" for gene in genes))
+    raise NoTargetsError(message)
+
+
+def _run_stages(genes, workdir, progress, max_workers, on_wait):
+    job = JobResult(genes=genes)
+    print(f"Received Gene IDs: {', '.join(genes)}")
+
+    progress("resolve", 10)
+    with stage("resolve"):
+        last_exons = resolve(genes, max_workers, job.errors)
+    progress("fetch", 40)
+    with stage("fetch"):
+        windows = fetch(last_exons, max_workers, job.errors)
+    job.unresolved = [gene for gene in genes if gene not in windows]
+    for gene in job.unresolved:
+        print(f"Skipping {gene}: {job.errors.get(gene, 'no last exon found')}")
+    if not windows:
+        _no_targets(genes, job.errors, f"No last exon could be resolved for {', '.join(genes)}")
+    # Windows without a single NGG site would only cost a FlashFry pass
+    for gene in [gene for gene, window in windows.items() if not count_protospacers(window.search_sequence)]:
+        print(f"Skipping {gene}: no NGG protospacer in the search window")
+        del windows[gene]
+        job.unresolved.append(gene)
+    if not windows:
+        _no_targets(genes, job.errors, f"No NGG protospacer near the last exon of {', '.join(genes)}")
+
+    progress("flashfry_queue", 45)
+    with get_admission().slot(on_wait):
+        progress("discover", 50)
+        discover_output = discover(windows, workdir)
+        progress("score", 60)
+        scored_output = score(discover_output, workdir)
+    progress("rank", 80)
+    results = rank(scored_output, windows)
+    progress("design", 85)
+    with stage("donor_design"):
+        results = design(results)
+    progress("persist", 90)
+    with stage("persist"):
+        job.results = persist(results, workdir)
+    progress("done", 100)
+    return job
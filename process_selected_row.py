@@ -1,21 +1,123 @@
 import pandas as pd
 import sys
 import json
+import os
+
+from sequence_utils import reverse_complement
+
+LEFT_AI1_TEMPLATE = "tgctggccttttgctcaggatccsnggatccCaaggcggtggaCTCGA"
+RIGHT_AI1_TEMPLATE = "CCTGCGGTGTCTTTGCTTrycatgtGGTTCCATGGTGTAATGGTTAGCACTCTGGACTCTGAATCCAGCGATCCGAGTTCAAATCTCGGTGGAACCTxGTTTTAGAGCTAGAAATAGCAA"
+# Homology arm lengths taken from the donor gDNA around the exon end and the cut site
+LEFT_ARM_LENGTH = 417
+RIGHT_ARM_LENGTH = 321
+
+
+def find_and_extract_sequence(gdna, target, upstream, downstream):
+    target_index = gdna.find(target)
+    if target_index == -1:
+        return None, None
+    upstream_sequence = gdna[max(0, target_index + len(target) - upstream):target_index + len(target)]
+    downstream_sequence = gdna[target_index + len(target) - 1:target_index + len(target) - 1 + downstream]
+    return upstream_sequence, downstream_sequence
+
+
+# Function to build the Left/Right-AI1 donors and homology arms for one guide
+def design_donor(gene_name, target, orientation, distance_from_exon, last_exon_seq, gdna_sequence):
+    sgRNA_sequence = target
+
+    if orientation == "RVS":
+        is_sgRNA_inverted = "Y"
+    else:
+        is_sgRNA_inverted = "N"
+
+    original_sgRNA = sgRNA_sequence
+
+    if is_sgRNA_inverted == "Y":
+        sgRNA_sequence = reverse_complement(original_sgRNA)
+
+    if len(last_exon_seq) >= 20:
+        protein_coding_exon = last_exon_seq[-20:]
+    else:
+        protein_coding_exon = last_exon_seq
+
+    left_arm, _ = find_and_extract_sequence(gdna_sequence, protein_coding_exon, LEFT_ARM_LENGTH, 0)
+
+    if is_sgRNA_inverted == "Y":
+        _, right_arm = find_and_extract_sequence(gdna_sequence, sgRNA_sequence[:7], 0, RIGHT_ARM_LENGTH)
+    else:
+        _, right_arm = find_and_extract_sequence(gdna_sequence, sgRNA_sequence[:18], 0, RIGHT_ARM_LENGTH)
+
+    if left_arm is None or right_arm is None:
+        raise ValueError(f"Could not place the {'left' if left_arm is None else 'right'} homology arm in the donor gDNA")
+
+    if is_sgRNA_inverted == "Y":
+        left_ai1_seq = LEFT_AI1_TEMPLATE.replace("s", original_sgRNA).replace("n", left_arm)
+    else:
+        left_ai1_seq = LEFT_AI1_TEMPLATE.replace("s", reverse_complement(original_sgRNA)).replace("n", left_arm)
+
+    right_ai1_seq = (
+        RIGHT_AI1_TEMPLATE.replace("r", right_arm)
+        .replace("y", original_sgRNA)
+        .replace("x", original_sgRNA[:20])
+    )
+
+    return {
+        "gene": gene_name,
+        "target": target,
+        "orientation": orientation,
+        "distance_from_exon": distance_from_exon,
+        "left_ai1": left_ai1_seq,
+        "right_ai1": right_ai1_seq,
+        "left_arm": left_arm,
+        "right_arm": right_arm,
+    }
+
+
+# Function to design donors for every row of a ranked guide table, in table order
+def design_donors(table, variables):
+    designs = []
+    for target, orientation, distance in zip(table['target'].tolist(), table['orientation'].tolist(),
+                                             table['Distance from Exon'].tolist()):
+        try:
+            designs.append(design_donor(variables["gene_ids"], target, orientation, distance,
+                                        variables["last_exon_seq"], variables["gdna_sequence"]))
+        except Exception as e:
+            designs.append({"gene": variables["gene_ids"], "target": target, "orientation": orientation,
+                            "distance_from_exon": distance, "error": str(e)})
+    return designs
+
+
+# Function to render a design as the text report shown for a selected row
+def format_design(design):
+    if "error" in design:
+        return (f"Target: {design['target']}\nOrientation: {design['orientation']}\n"
+                f"Distance from Exon: {design['distance_from_exon']}\n"
+                f"No donor could be designed: {design['error']}\n")
+    return (
+        f"Target: {design['target']}\n"
+        f"Orientation: {design['orientation']}\n"
+        f"Distance from Exon: {design['distance_from_exon']}\n"
+        f">>{design['gene']}-Left-AI1\n{design['left_ai1']}\n\n"
+        f">>{design['gene']}-Right-AI1\n{design['right_ai1']}\n\n"
+        f"Left_arm sequence:\n{design['left_arm']}\n"
+        f"Right_arm sequence:\n{design['right_arm']}\n"
+    )
+
 
 def process_selected_row(csv_file):
     try:
         # Load the selected row from the CSV file
         df = pd.read_csv(csv_file)
         print(f"Loaded selected row from CSV file: {csv_file}")
-        
+
         # Display the DataFrame (you can replace this with your own processing logic)
         print("Selected Row Data:")
         print(df)
-        
+
         # Ensure the expected columns are present
         expected_columns = ['target', 'orientation', 'Distance from Exon']
         missing_columns = [col for col in expected_columns if col not in df.columns]
-        
+
         if missing_columns:
             raise ValueError(f"Missing columns in the CSV file: {', '.join(missing_columns)}")
 
@@ -23,87 +125,30 @@ def process_selected_row(csv_file):
         selected_target = df['target'].values[0] if 'target' in df.columns else 'N/A'
         selected_orientation = df['orientation'].values[0] if 'orientation' in df.columns else 'N/A'
         selected_distance_from_exon = df['Distance from Exon'].values[0] if 'Distance from Exon' in df.columns else 'N/A'
-        
+
         print(f"Target: {selected_target}")
         print(f"Orientation: {selected_orientation}")
         print(f"Distance from Exon: {selected_distance_from_exon}")
 
         # Load additional variables from JSON
         def load_variables():
-            with open('variables.json', 'r') as file:
+            # Batch runs write one {gene}_variables.json per gene next to the selected row CSV
+            gene_variables = csv_file.replace('_selected_row.csv', '_variables.json')
+            variables_file = gene_variables if os.path.exists(gene_variables) else 'variables.json'
+            with open(variables_file, 'r') as file:
                 variables = json.load(file)
             return variables["gene_ids"], variables["last_exon_seq"], variables["gdna_sequence"]
 
         gene_ids, last_exon_seq, gdna_sequence = load_variables()
 
-        def find_and_extract_sequence(gdna, target, upstream, downstream):
-            target_index = gdna.find(target)
-            if target_index == -1:
-                return None, None
-            upstream_sequence = gdna[max(0, target_index + len(target) - upstream):target_index + len(target)]
-            downstream_sequence = gdna[target_index + len(target) - 1:target_index + len(target) - 1 + downstream]
-            return upstream_sequence, downstream_sequence
-
-        def reverse_complement(seq):
-            complement = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
-            return ''.join(complement[base] for base in reversed(seq))
-
-        gene_name = gene_ids
-        sgRNA_sequence = selected_target
-
-        if selected_orientation == "RVS":
-            is_sgRNA_inverted = "Y"
-        else:
-            is_sgRNA_inverted = "N"
-
-        original_sgRNA = sgRNA_sequence
-
-        if is_sgRNA_inverted == "Y":
-            sgRNA_sequence = reverse_complement(original_sgRNA)
-
-        if len(last_exon_seq) >= 20:
-            protein_coding_exon = last_exon_seq[-20:]
-        else:
-            protein_coding_exon = last_exon_seq
-
-        left_arm, _ = find_and_extract_sequence(gdna_sequence, protein_coding_exon, 417, 0)
-
-        if is_sgRNA_inverted == "Y":
-            _, right_arm = find_and_extract_sequence(gdna_sequence, sgRNA_sequence[:7], 0, 321)
-        else:
-            _, right_arm = find_and_extract_sequence(gdna_sequence, sgRNA_sequence[:18], 0, 321)
-
-        left_ai1_template = "tgctggccttttgctcaggatccsnggatccCaaggcggtggaCTCGA"
-        if is_sgRNA_inverted == "Y":
-            left_ai1_seq = left_ai1_template.replace("s", original_sgRNA).replace("n", left_arm)
-        else:
-            left_ai1_seq = left_ai1_template.replace("s", reverse_complement(original_sgRNA)).replace("n", left_arm)
-        
-        right_ai1_template = "CCTGCGGTGTCTTTGCTTrycatgtGGTTCCATGGTGTAATGGTTAGCACTCTGGACTCTGAATCCAGCGATCCGAGTTCAAATCTCGGTGGAACCTxGTTTTAGAGCTAGAAATAGCAA"
-        if is_sgRNA_inverted == "Y":
-            right_ai1_seq = (
-                right_ai1_template.replace("r", right_arm)
-                .replace("y", original_sgRNA)
-                .replace("x", original_sgRNA[:20])
-            )
-        else:
-            right_ai1_seq = (
-                right_ai1_template.replace("r", right_arm)
-                .replace("y", original_sgRNA)
-                .replace("x", original_sgRNA[:20])
-            )
-        
+        design = design_donor(gene_ids, selected_target, selected_orientation, selected_distance_from_exon,
+                              last_exon_seq, gdna_sequence)
+
         # Save output to a .txt file
         processed_output_file = csv_file.replace('.csv', '_processed_output.txt')
         with open(processed_output_file, 'w') as file:
-            file.write(f"Target: {selected_target}\n")
-            file.write(f"Orientation: {selected_orientation}\n")
-            file.write(f"Distance from Exon: {selected_distance_from_exon}\n")
-            file.write(f">>{gene_name}-Left-AI1\n{left_ai1_seq}\n\n")
-            file.write(f">>{gene_name}-Right-AI1\n{right_ai1_seq}\n\n")
-            file.write(f"Left_arm sequence:\n{left_arm}\n")
-            file.write(f"Right_arm sequence:\n{right_arm}\n")
-        
+            file.write(format_design(design))
+
         print(f"Processed output saved to {processed_output_file}")
 
     except Exception as e:
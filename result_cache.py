@@ -0,0 +1,184 @@
+import os, json, shutil, hashlib, tempfile, threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import sequence_provider
+from sequence_provider import GENOME_BUILD, SEARCH_UPSTREAM, SEARCH_DOWNSTREAM
+from annotation_index import GENE_RESOLVER
+from flashfry_worker import SCORING_METRICS, FLASHFRY_VERSION
+
+# On-disk cache of finished per-gene results
+RESULT_CACHE_DIR = os.path.abspath(os.environ.get("CRISPR_RESULT_CACHE", "result_cache"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("CRISPR_RESULT_CACHE_MAX_BYTES", 1024 ** 3))
+# Parsed result tables kept in memory by the web server
+TABLE_CACHE_ENTRIES = int(os.environ.get("CRISPR_TABLE_CACHE_ENTRIES", 128))
+
+
+# Function to build the content address of one gene's result under the current pipeline settings
+def result_key(gene, build=GENOME_BUILD, window=(SEARCH_UPSTREAM, SEARCH_DOWNSTREAM),
+               metrics=SCORING_METRICS, flashfry_version=FLASHFRY_VERSION, resolver=GENE_RESOLVER, sequence=None):
+    # The sequence data is looked up at call time: server.py reconfigures the source after this module is imported
+    fields = {
+        "gene": gene.strip().upper(),
+        "build": build,
+        "window": list(window),
+        "metrics": sorted(metrics.split(",")),
+        "flashfry": flashfry_version,
+        "resolver": resolver,
+        "sequence": sequence or sequence_provider.sequence_identity(),
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Ranked guide tables and donor-design inputs stored per key, evicted least recently used by size."""
+
+    TABLE = "CRISPR_tgts.csv"
+    VARIABLES = "variables.json"
+    DONORS = "donors.json"
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Serialises replacing and evicting entries between this process's jobs; other processes
+        # sharing the directory can still remove an entry at any time, so readers tolerate that
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry(self, gene):
+        return os.path.join(self.cache_dir, result_key(gene))
+
+    def lookup(self, gene):
+        """Return the entry directory for gene, or None; a hit refreshes its LRU timestamp."""
+        entry = self._entry(gene)
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return entry if os.path.exists(os.path.join(entry, self.TABLE)) else None
+
+    def store(self, gene, table_path, variables, donors=None):
+        entry = self._entry(gene)
+        staging = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        shutil.copyfile(table_path, os.path.join(staging, self.TABLE))
+        with open(os.path.join(staging, self.VARIABLES), "w") as file:
+            json.dump(variables, file)
+        if donors is not None:
+            with open(os.path.join(staging, self.DONORS), "w") as file:
+                json.dump(donors, file)
+        with self._lock:
+            shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # Another job stored the same result first
+                shutil.rmtree(staging, ignore_errors=True)
+            self._evict()
+
+    def restore(self, gene, workdir):
+        """Copy a cached result into workdir under the names the web views expect; False if it is gone."""
+        entry = self.lookup(gene)
+        if entry is None:
+            return False
+        try:
+            shutil.copyfile(os.path.join(entry, self.TABLE), os.path.join(workdir, f"{gene}_CRISPR_tgts.csv"))
+            with open(os.path.join(entry, self.VARIABLES)) as file:
+                variables = json.load(file)
+            if os.path.exists(os.path.join(entry, self.DONORS)):
+                shutil.copyfile(os.path.join(entry, self.DONORS), os.path.join(workdir, f"{gene}_donors.json"))
+        except FileNotFoundError:
+            # Evicted or replaced since lookup(); the caller treats it as a miss
+            return False
+        variables["gene_ids"] = gene
+        with open(os.path.join(workdir, f"{gene}_variables.json"), "w") as file:
+            json.dump(variables, file)
+        return True
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".tmp-") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                # Replaced or evicted by another process while we looked
+                continue
+            entries.append((mtime, size, path))
+            total += size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+# Function to identify one version of a file; it changes whenever the file is rewritten
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class MemoryCache:
+    """In-process LRU of values built from files, rebuilt when the files' signature changes."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, signature, build):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return entry[1]
+        # Built outside the lock; two threads racing on a miss both build and the last one is kept
+        value = build()
+        with self._lock:
+            self._entries[key] = (signature, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_tables = MemoryCache(TABLE_CACHE_ENTRIES)
+
+
+# Function to open the shared result cache once per process
+def get_result_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
+
+
+# Function to read a result table through the in-memory LRU; callers must not modify the frame
+def load_table(path):
+    path = os.path.abspath(path)
+    return _tables.get(path, file_signature(path), lambda: pd.read_csv(path))
+
+
+# Function to read a JSON result file, such as a job's donor designs, through the same LRU; callers must not modify it
+def load_json(path):
+    path = os.path.abspath(path)
+
+    def read():
+        with open(path) as file:
+            return json.load(file)
+
+    return _tables.get(path, file_signature(path), read)
@@ -0,0 +1,187 @@
+import os, sys, json, pickle
+import numpy as np
+import pandas as pd
+
+from pam_discovery import SPACER_LENGTH, SITE_LENGTH
+
+# Doench 2016 CFD lookup tables, as published (pickled dicts) or the same dicts as JSON
+CFD_MISMATCH_SCORES = os.environ.get("CRISPR_CFD_MISMATCH_SCORES", "mismatch_score.pkl")
+CFD_PAM_SCORES = os.environ.get("CRISPR_CFD_PAM_SCORES", "pam_scores.pkl")
+
+_BASES = "ACGT"
+_CODES = np.full(256, -1, dtype=np.int8)
+_CODES[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4)
+_COMPLEMENT = np.array([3, 2, 1, 0])
+
+# Doench et al. 2014 (Rule Set 1) logistic model over the 30-mer context: (0-based position, bases, weight)
+DOENCH2014_INTERCEPT = 0.59763615
+DOENCH2014_GC_HIGH = -0.1665878
+DOENCH2014_GC_LOW = -0.2026259
+DOENCH2014_WEIGHTS = [
+    (1, 'G', -0.2753771), (2, 'A', -0.3238875), (2, 'C', 0.17212887), (3, 'C', -0.1006662),
+    (4, 'C', -0.2018029), (4, 'G', 0.24595663), (5, 'A', 0.03644004), (5, 'C', 0.09837684),
+    (6, 'C', -0.7411813), (6, 'G', -0.3932644), (11, 'A', -0.466099), (14, 'A', 0.08537695),
+    (14, 'C', -0.013814), (15, 'A', 0.27262051), (15, 'C', -0.1190226), (15, 'T', -0.2859442),
+    (16, 'A', 0.09745459), (16, 'G', -0.1755462), (17, 'C', -0.3457955), (17, 'G', -0.6780964),
+    (18, 'A', 0.22508903), (18, 'C', -0.5077941), (19, 'G', -0.4173736), (19, 'T', -0.054307),
+    (20, 'G', 0.37989937), (20, 'T', -0.0907126), (21, 'C', 0.05782332), (21, 'T', -0.5305673),
+    (22, 'T', -0.8770074), (23, 'C', -0.8762358), (23, 'G', 0.27891626), (23, 'T', -0.4031022),
+    (24, 'A', -0.0773007), (24, 'C', 0.28793562), (24, 'T', -0.2216372), (27, 'G', -0.6890167),
+    (27, 'T', 0.11787758), (28, 'C', -0.1604453), (29, 'G', 0.38634258), (1, 'GT', -0.6257787),
+    (4, 'GC', 0.30004332), (5, 'AA', -0.8348362), (5, 'TA', 0.76062777), (6, 'GG', -0.4908167),
+    (11, 'GG', -1.5169074), (11, 'TA', 0.7092612), (11, 'TC', 0.49629861), (11, 'TT', -0.5868739),
+    (12, 'GG', -0.3345637), (13, 'GA', 0.76384993), (13, 'GC', -0.5370252), (16, 'TG', -0.7981461),
+    (18, 'GG', -0.6668087), (18, 'TC', 0.35318325), (19, 'CC', 0.74807209), (19, 'TG', -0.3672668),
+    (20, 'AC', 0.56820913), (20, 'CG', 0.32907207), (20, 'GA', -0.8364568), (20, 'GG', -0.7822076),
+    (21, 'TC', -1.029693), (22, 'CG', 0.85619782), (22, 'CT', -0.4632077), (23, 'AA', -0.5794924),
+    (23, 'AG', 0.64907554), (24, 'AG', -0.0773007), (24, 'CG', 0.28793562), (24, 'TG', -0.2216372),
+    (26, 'GT', 0.11787758), (28, 'GG', -0.69774),
+]
+CONTEXT_LENGTH = 30
+
+# Hsu et al. 2013 (MIT) per-position mismatch weights, PAM-distal first
+HSU2013_WEIGHTS = np.array([0, 0, 0.014, 0, 0, 0.395, 0.317, 0, 0.389, 0.079, 0.445, 0.508,
+                            0.613, 0.851, 0.732, 0.828, 0.615, 0.804, 0.685, 0.583])
+
+
+# Function to encode equal-length sequences as an (n, length) array of base codes, -1 for anything else
+def encode(seqs, length):
+    seqs = [seq.upper() for seq in seqs]
+    if any(len(seq) != length for seq in seqs):
+        raise ValueError(f"All sequences must be {length} bp")
+    codes = np.frombuffer("".join(seqs).encode(), dtype=np.uint8)
+    return _CODES[codes].reshape(len(seqs), length)
+
+
+def one_hot(codes):
+    return codes[..., None] == np.arange(4)
+
+
+def one_hot_16(codes):
+    return codes[..., None] == np.arange(16)
+
+
+def _doench2014_tables():
+    single = np.zeros((CONTEXT_LENGTH, 4))
+    double = np.zeros((CONTEXT_LENGTH - 1, 16))
+    for position, bases, weight in DOENCH2014_WEIGHTS:
+        if len(bases) == 1:
+            single[position, _BASES.index(bases)] = weight
+        else:
+            double[position, 4 * _BASES.index(bases[0]) + _BASES.index(bases[1])] = weight
+    return single, double
+
+
+_DOENCH2014_SINGLE, _DOENCH2014_DOUBLE = _doench2014_tables()
+
+
+# Function to score 30-mer contexts (4 bp + 20mer + NGG + 3 bp) with the Doench 2014 on-target model
+def doench2014_on_target(contexts):
+    codes = encode(contexts, CONTEXT_LENGTH)
+    score = DOENCH2014_INTERCEPT + (one_hot(codes) * _DOENCH2014_SINGLE).sum(axis=(1, 2))
+    pairs = np.where((codes[:, :-1] >= 0) & (codes[:, 1:] >= 0), 4 * codes[:, :-1] + codes[:, 1:], -1)
+    score += (one_hot_16(pairs) * _DOENCH2014_DOUBLE).sum(axis=(1, 2))
+    gc = np.isin(codes[:, 4:4 + SPACER_LENGTH], (1, 2)).sum(axis=1)
+    score += np.where(gc > 10, (gc - 10) * DOENCH2014_GC_HIGH, 0) + np.where(gc < 10, (10 - gc) * DOENCH2014_GC_LOW, 0)
+    return 1 / (1 + np.exp(-score))
+
+
+# Function to compute Hsu 2013 hit scores for aligned guide/off-target pairs (0-100, 100 for a perfect match)
+def hsu2013_hit_scores(guides, off_targets):
+    mismatched = encode([g[:SPACER_LENGTH] for g in guides], SPACER_LENGTH) != \
+        encode([t[:SPACER_LENGTH] for t in off_targets], SPACER_LENGTH)
+    count = mismatched.sum(axis=1)
+    positional = np.prod(np.where(mismatched, 1 - HSU2013_WEIGHTS, 1.0), axis=1)
+    # Mean distance between consecutive mismatches is their overall span over the gaps between them
+    index = np.arange(SPACER_LENGTH)
+    first = np.where(mismatched, index, SPACER_LENGTH).min(axis=1)
+    last = np.where(mismatched, index, -1).max(axis=1)
+    mean_distance = np.where(count > 1, (last - first) / np.maximum(count - 1, 1), 0)
+    spread = np.where(count > 1, 1 / ((19 - mean_distance) / 19 * 4 + 1), 1.0)
+    density = 1 / np.maximum(count, 1) ** 2
+    return positional * spread * density * 100
+
+
+_cfd_tables = None
+
+
+def _load_table(path):
+    if path.endswith(".json"):
+        with open(path) as table_file:
+            return json.load(table_file)
+    with open(path, "rb") as table_file:
+        return pickle.load(table_file)
+
+
+# Function to load the CFD tables into arrays: mismatch[position, rna base, dna base] and pam[base, base]
+def cfd_tables(mismatch_path=CFD_MISMATCH_SCORES, pam_path=CFD_PAM_SCORES):
+    global _cfd_tables
+    if _cfd_tables is None:
+        for path in (mismatch_path, pam_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"CFD table {path} not found; set CRISPR_CFD_MISMATCH_SCORES/CRISPR_CFD_PAM_SCORES "
+                                        "to the Doench 2016 mismatch_score and pam_scores files")
+        mismatch = np.ones((SPACER_LENGTH, 4, 4))
+        for key, value in _load_table(mismatch_path).items():
+            # Keys look like "rA:dG,5": RNA base, DNA base (complement strand) and 1-based position
+            pair, position = key.split(",")
+            rna, dna = pair[1], pair[-1]
+            mismatch[int(position) - 1, _BASES.index(rna.replace("U", "T")), _BASES.index(dna)] = value
+        pam = np.zeros((4, 4))
+        for key, value in _load_table(pam_path).items():
+            pam[_BASES.index(key[-2]), _BASES.index(key[-1])] = value
+        _cfd_tables = (mismatch, pam)
+    return _cfd_tables
+
+
+# Function to compute CFD scores for aligned guide/off-target 23-mer pairs
+def cfd_scores(guides, off_targets):
+    mismatch, pam = cfd_tables()
+    guide_codes = encode(guides, SITE_LENGTH)[:, :SPACER_LENGTH]
+    target_codes = encode(off_targets, SITE_LENGTH)
+    spacer = target_codes[:, :SPACER_LENGTH]
+    # The tables index the DNA base on the strand the guide pairs with
+    lookup = mismatch[np.arange(SPACER_LENGTH), guide_codes, _COMPLEMENT[spacer]]
+    per_position = np.where(guide_codes == spacer, 1.0, lookup)
+    return per_position.prod(axis=1) * pam[target_codes[:, -2], target_codes[:, -1]]
+
+
+# Function to aggregate off-target hits into FlashFry's guide-level columns
+def score_guides(guides, hits, contexts=None, cfd=True):
+    """hits has guide, off_target, mismatches and occurrences columns (see offtarget_db.search).
+
+    The guide's own site is one of its perfect matches and is left out of the off-target sums.
+    """
+    unique = pd.Index(guides).unique()
+    guide_rows = unique.get_indexer(hits["guide"])
+    occurrences = hits["occurrences"].to_numpy() - (hits["mismatches"].to_numpy() == 0)
+    per_guide = pd.DataFrame(index=unique)
+    hsu = hsu2013_hit_scores(hits["guide"].tolist(), hits["off_target"].tolist()) * occurrences
+    per_guide["Hsu2013"] = 100 * 100 / (100 + np.bincount(guide_rows, weights=hsu, minlength=len(unique)))
+    if cfd:
+        off = cfd_scores(hits["guide"].tolist(), hits["off_target"].tolist())
+        total = np.bincount(guide_rows, weights=off * occurrences, minlength=len(unique))
+        max_ot = np.zeros(len(unique))
+        np.maximum.at(max_ot, guide_rows, np.where(occurrences > 0, off, 0))
+        per_guide["DoenchCFD_maxOT"] = max_ot
+        per_guide["DoenchCFD_specificityscore"] = 1 / (1 + total)
+    scores = per_guide.loc[guides].reset_index(names="target")
+    if contexts is not None:
+        scores.insert(1, "Doench2014OnTarget", doench2014_on_target(contexts))
+    return scores
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Native discovery, in-process off-target search and scoring for a FASTA, without the jar
+        from pam_discovery import discover_fasta
+        from offtarget_db import get_offtarget_database, OFFTARGET_MAX_MISMATCHES
+        sites = discover_fasta(sys.argv[1])
+        sites = sites[sites["context"] != ""].reset_index(drop=True)
+        guides = sites["target"].tolist()
+        hits = get_offtarget_database().search(sorted(set(guides)), OFFTARGET_MAX_MISMATCHES)
+        have_cfd = all(os.path.exists(path) for path in (CFD_MISMATCH_SCORES, CFD_PAM_SCORES))
+        scores = score_guides(guides, hits, sites["context"].tolist(), cfd=have_cfd)
+        print(pd.concat([sites, scores.drop(columns="target")], axis=1).to_csv(sep="\t", index=False), end="")
+    else:
+        print("Usage: python scoring.py sequence.fa")
@@ -0,0 +1,215 @@
+import os, mmap, bisect, struct, zlib
+import http_client
+from metrics import stage
+from sequence_utils import reverse_complement
+
+# Where region sequence comes from. "local" reads the indexed GRCh38 FASTA,
+# "ensembl" uses the REST API, "auto" tries the FASTA and falls back to Ensembl.
+SEQUENCE_SOURCE = os.environ.get("CRISPR_SEQUENCE_SOURCE", "auto")
+GENOME_FASTA = os.environ.get("CRISPR_GENOME_FASTA", "GRCh38.primary_assembly.genome.fa")
+ENSEMBL_SERVER = os.environ.get("CRISPR_ENSEMBL_SERVER", "https://rest.ensembl.org")
+GENOME_BUILD = "GRCh38"
+
+# CRISPR search window around the last exon end: bases upstream and downstream on the gene's strand
+SEARCH_UPSTREAM = int(os.environ.get("CRISPR_SEARCH_UPSTREAM", 50))
+SEARCH_DOWNSTREAM = int(os.environ.get("CRISPR_SEARCH_DOWNSTREAM", 32))
+
+
+# Function to read a samtools .fai index into {name: (length, offset, linebases, linewidth)}
+def read_fai(fai_path):
+    index = {}
+    with open(fai_path) as fai_file:
+        for line in fai_file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 5:
+                continue
+            index[fields[0]] = tuple(int(value) for value in fields[1:5])
+    return index
+
+
+# Function to read a bgzip .gzi index into a sorted list of (compressed, uncompressed) offsets
+def read_gzi(gzi_path):
+    with open(gzi_path, "rb") as gzi_file:
+        data = gzi_file.read()
+    (count,) = struct.unpack_from("<Q", data, 0)
+    blocks = [(0, 0)]
+    for i in range(count):
+        blocks.append(struct.unpack_from("<QQ", data, 8 + 16 * i))
+    return blocks
+
+
+class FastaSequenceProvider:
+    """Slice regions out of a local FASTA (plain or bgzip) using its .fai index."""
+
+    def __init__(self, fasta_path):
+        self.fasta_path = fasta_path
+        self.index = read_fai(fasta_path + ".fai")
+        self._file = open(fasta_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        gzi_path = fasta_path + ".gzi"
+        self._blocks = read_gzi(gzi_path) if os.path.exists(gzi_path) else None
+        # Uncompressed block offsets, ascending, for bisecting to the block that holds a position
+        self._block_starts = [uncompressed for _, uncompressed in self._blocks] if self._blocks else None
+
+    def _contig(self, chromosome):
+        chromosome = str(chromosome)
+        for name in (chromosome, "chr" + chromosome, chromosome[3:] if chromosome.startswith("chr") else None):
+            if name and name in self.index:
+                return name
+        if chromosome in ("MT", "chrM") and "chrM" in self.index:
+            return "chrM"
+        raise KeyError(f"Chromosome {chromosome} not found in {self.fasta_path}")
+
+    def _read_plain(self, begin, end):
+        return self._mmap[begin:end]
+
+    def _read_bgzip(self, begin, end):
+        # Decompress only the BGZF blocks that overlap [begin, end)
+        lo = max(bisect.bisect_right(self._block_starts, begin) - 1, 0)
+        compressed, block_start = self._blocks[lo]
+        chunks = []
+        position = block_start
+        while position < end and compressed < len(self._mmap):
+            block_size = struct.unpack_from("<H", self._mmap, compressed + 16)[0] + 1
+            payload = zlib.decompress(self._mmap[compressed + 18:compressed + block_size - 8], -15)
+            if not payload:
+                break
+            chunks.append(payload)
+            position += len(payload)
+            compressed += block_size
+        data = b"".join(chunks)
+        return data[begin - block_start:end - block_start]
+
+    def fetch(self, chromosome, start, end):
+        """Return the forward-strand sequence for 1-based inclusive [start, end]."""
+        length, offset, linebases, linewidth = self.index[self._contig(chromosome)]
+        start = max(1, start)
+        end = min(length, end)
+        if end < start:
+            return ""
+        first = start - 1
+        begin = offset + (first // linebases) * linewidth + first % linebases
+        stop = offset + ((end - 1) // linebases) * linewidth + (end - 1) % linebases + 1
+        with stage("fasta_fetch") as span:
+            if self._blocks is None:
+                raw = self._read_plain(begin, stop)
+            else:
+                raw = self._read_bgzip(begin, stop)
+            span.add_bytes(len(raw))
+        return raw.replace(b"\n", b"").replace(b"\r", b"").decode("ascii").upper()
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+class EnsemblSequenceProvider:
+    """Fetch regions from the Ensembl REST API."""
+
+    def __init__(self, server=ENSEMBL_SERVER):
+        self.server = server
+
+    def fetch(self, chromosome, start, end):
+        ext = f"/sequence/region/human/{chromosome}:{start}..{end}:1?coord_system_version=GRCh38"
+        with stage("ensembl_fetch"):
+            r = http_client.get(self.server + ext, headers={"Content-Type": "application/json"})
+            r.raise_for_status()
+            return r.json().get("seq")
+
+
+class FallbackSequenceProvider:
+    """Try each provider in turn, falling back on missing contigs or errors."""
+
+    def __init__(self, providers):
+        self.providers = providers
+
+    def fetch(self, chromosome, start, end):
+        last_error = None
+        for provider in self.providers:
+            try:
+                return provider.fetch(chromosome, start, end)
+            except Exception as e:
+                print(f"{type(provider).__name__} failed for {chromosome}:{start}..{end}: {e}")
+                last_error = e
+        raise last_error
+
+
+_provider = None
+
+
+# Function to build the provider selected by CRISPR_SEQUENCE_SOURCE
+def get_sequence_provider(source=None, fasta_path=None):
+    global _provider
+    default = source is None and fasta_path is None
+    if default and _provider is not None:
+        return _provider
+    source = source or SEQUENCE_SOURCE
+    fasta_path = fasta_path or GENOME_FASTA
+    has_fasta = os.path.exists(fasta_path) and os.path.exists(fasta_path + ".fai")
+
+    if source == "local":
+        if not has_fasta:
+            raise FileNotFoundError(f"Indexed FASTA not found: {fasta_path} (+ .fai)")
+        provider = FastaSequenceProvider(fasta_path)
+    elif source == "ensembl":
+        provider = EnsemblSequenceProvider()
+    elif has_fasta:
+        provider = FallbackSequenceProvider([FastaSequenceProvider(fasta_path), EnsemblSequenceProvider()])
+    else:
+        provider = EnsemblSequenceProvider()
+
+    # Only the default provider is shared; an explicit source or FASTA must not replace it
+    if default:
+        _provider = provider
+    return provider
+
+
+# Function to name the sequence data the configured source reads; "local" and "auto" over the same FASTA agree
+def sequence_identity(source=None, fasta_path=None):
+    source = source or SEQUENCE_SOURCE
+    fasta_path = fasta_path or GENOME_FASTA
+    if source != "ensembl" and os.path.exists(fasta_path) and os.path.exists(fasta_path + ".fai"):
+        return f"{os.path.basename(fasta_path)}:{os.path.getsize(fasta_path)}"
+    return f"ensembl:{GENOME_BUILD}"
+
+
+# Function to change the default source/FASTA for this process, e.g. from server.py
+def configure(source=None, fasta_path=None):
+    global SEQUENCE_SOURCE, GENOME_FASTA, _provider
+    SEQUENCE_SOURCE = source or SEQUENCE_SOURCE
+    GENOME_FASTA = fasta_path or GENOME_FASTA
+    _provider = None
+
+
+# Function to fetch a GRCh38 region with the configured provider
+def fetch_region(chromosome, start, end):
+    return get_sequence_provider().fetch(chromosome, start, end)
+
+
+class RegionBuffer:
+    """One fetched span of a chromosome that nested windows are sliced from."""
+
+    def __init__(self, chromosome, start, end, sequence):
+        self.chromosome = chromosome
+        self.start = start
+        self.end = end
+        self.sequence = sequence
+
+    def slice(self, start, end, reverse=False):
+        """Return 1-based inclusive [start, end], reverse-complemented if reverse is set."""
+        if start < self.start or end > self.end:
+            raise ValueError(f"{self.chromosome}:{start}..{end} is outside the fetched span {self.start}..{self.end}")
+        seq = self.sequence[start - self.start:end - self.start + 1]
+        if reverse:
+            return reverse_complement(seq)
+        return seq
+
+
+
+# Function to plan the union of several windows on one chromosome and fetch it once
+def fetch_superset(chromosome, spans):
+    start = max(1, min(span_start for span_start, _ in spans))
+    end = max(span_end for _, span_end in spans)
+    print(f"Fetching superset region: Chromosome {chromosome}, Start {start}, End {end}")
+    sequence = fetch_region(chromosome, start, end)
+    return RegionBuffer(chromosome, start, start + len(sequence) - 1, sequence)
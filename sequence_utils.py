@@ -0,0 +1,69 @@
+import numpy as np
+
+# IUPAC nucleotide codes and their complements; case is preserved and unknown characters pass through
+IUPAC_COMPLEMENTS = {
+    'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'U': 'A', 'N': 'N',
+    'R': 'Y', 'Y': 'R', 'S': 'S', 'W': 'W', 'K': 'M', 'M': 'K',
+    'B': 'V', 'V': 'B', 'D': 'H', 'H': 'D',
+}
+_FROM = ''.join(IUPAC_COMPLEMENTS) + ''.join(IUPAC_COMPLEMENTS).lower()
+_TO = ''.join(IUPAC_COMPLEMENTS.values()) + ''.join(IUPAC_COMPLEMENTS.values()).lower()
+_COMPLEMENT_STR = str.maketrans(_FROM, _TO)
+_COMPLEMENT_BYTES = bytes.maketrans(_FROM.encode(), _TO.encode())
+# The same table as a NumPy lookup for uint8 sequence arrays
+COMPLEMENT_BYTES = np.frombuffer(_COMPLEMENT_BYTES, dtype=np.uint8)
+
+
+# Function to get the reverse complement of a DNA sequence given as str or bytes
+def reverse_complement(seq):
+    if isinstance(seq, str):
+        return seq.translate(_COMPLEMENT_STR)[::-1]
+    return bytes(seq).translate(_COMPLEMENT_BYTES)[::-1]
+
+
+class KmerIndex:
+    """Sorted k-mer table of one sequence, so many patterns are located with a single searchsorted.
+
+    Each pattern length gets its own table the first time it is queried. Positions are 0-based and
+    matching is exact, like str.find.
+    """
+
+    def __init__(self, seq):
+        self.seq = seq.encode() if isinstance(seq, str) else bytes(seq)
+        self._tables = {}
+
+    def _table(self, width):
+        if width not in self._tables:
+            array = np.frombuffer(self.seq, dtype=np.uint8)
+            if len(array) < width:
+                self._tables[width] = (np.empty(0, dtype=f'S{width}'), np.empty(0, dtype=np.int64))
+            else:
+                kmers = np.ascontiguousarray(np.lib.stride_tricks.sliding_window_view(array, width))
+                kmers = kmers.view(f'S{width}').ravel()
+                # A stable sort keeps equal k-mers in sequence order, so the first of a run is the leftmost
+                order = np.argsort(kmers, kind='stable')
+                self._tables[width] = (kmers[order], order)
+        return self._tables[width]
+
+    def locate(self, patterns):
+        """Leftmost position of each pattern (-1 if absent) and how many times it occurs."""
+        patterns = [p.encode() if isinstance(p, str) else bytes(p) for p in patterns]
+        first = np.full(len(patterns), -1, dtype=np.int64)
+        counts = np.zeros(len(patterns), dtype=np.int64)
+        lengths = np.array([len(p) for p in patterns], dtype=np.int64)
+        for width in np.unique(lengths):
+            rows = np.flatnonzero(lengths == width)
+            if width == 0:
+                # The empty pattern matches before every base, as with str.find
+                first[rows], counts[rows] = 0, len(self.seq) + 1
+                continue
+            kmers, order = self._table(int(width))
+            if not len(kmers):
+                continue
+            keys = np.array([patterns[i] for i in rows], dtype=f'S{width}')
+            left = np.searchsorted(kmers, keys, side='left')
+            right = np.searchsorted(kmers, keys, side='right')
+            found = right > left
+            first[rows[found]] = order[left[found]]
+            counts[rows] = right - left
+        return first, counts
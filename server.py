@@ -1,54 +1,74 @@
-from flask import Flask, request, redirect, url_for, render_template, jsonify
+from flask import Flask, request, redirect, url_for, render_template, jsonify, Response, stream_with_context
 import pandas as pd
-import subprocess
-import threading
 import os
+import json
+import gzip
+import hashlib
+from flashfry_worker import start_service, get_admission, FLASHFRY_JAR, FLASHFRY_WORKERS
+import sequence_provider
+from job_manager import JobManager, QueueFull
+from result_cache import get_result_cache, load_table, file_signature, MemoryCache
+from guide_store import get_guide_store
+from pipeline import run_job, load_donors
+from metrics import get_metrics
+from process_selected_row import design_donor, format_design
 
 app = Flask(__name__)
 
-# Global variable to store progress
-progress = 0
+# Sequence source for jobs started from the web; "local" keeps region fetches off the network
+SEQUENCE_SOURCE = os.environ.get('CRISPR_SEQUENCE_SOURCE', 'local')
+sequence_provider.configure(SEQUENCE_SOURCE)
 
-def get_filtered_df(gene_ids):
+job_manager = JobManager()
+
+# How long one long-poll or SSE wait may block before the server answers anyway
+PROGRESS_WAIT = int(os.environ.get('CRISPR_PROGRESS_WAIT', 25))
+
+# Rendered /dataframe pages and JSON bodies, with their gzip copies, kept per result-file version
+PAGE_CACHE_ENTRIES = int(os.environ.get('CRISPR_PAGE_CACHE_ENTRIES', 256))
+page_cache = MemoryCache(PAGE_CACHE_ENTRIES)
+
+def job_workdir(job_id):
+    """Directory holding a job's files; requests without a job ID use the current directory."""
+    if not job_id:
+        return '.'
+    job = job_manager.get(job_id)
+    if job is None:
+        raise FileNotFoundError(f"Unknown job {job_id}")
+    return job.workdir
+
+def get_filtered_df(gene_ids, workdir='.'):
     """Retrieve filtered DataFrame based on gene_ids."""
     try:
-        file_path = f'{gene_ids}_CRISPR_tgts.csv'
+        file_path = os.path.join(workdir, f'{gene_ids}_CRISPR_tgts.csv')
         if os.path.exists(file_path):
-            df = pd.read_csv(file_path)
-            return df
+            return load_table(file_path).copy()
         else:
             raise FileNotFoundError(f"No CSV file found for {gene_ids}")
     except Exception as e:
         print(f"An error occurred while loading the DataFrame: {str(e)}")
         return pd.DataFrame()
 
-def run_crispr_tool(gene_ids):
-    """Run the CRISPR web tool and update progress."""
-    global progress
-    try:
-        process = subprocess.Popen(
-            ['python3', 'crispr_webtooltest.py', gene_ids],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1, universal_newlines=True
-        )
-
-        for line in process.stdout:
-            line = line.strip()
-            print(f"Subprocess Output: {line}")
-            if "Progress" in line:
-                progress = int(line.split()[1].replace('%', ''))
-                print(f"Updated Progress: {progress}%")
-
-        process.wait()
-        progress = 100
-
-        stderr_output = process.stderr.read()
-        if stderr_output:
-            print(f"Subprocess Error: {stderr_output}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"CRISPR-Webtool Error: {e.stderr}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {str(e)}")
+def get_combined_df(genes, workdir='.'):
+    """Concatenate the per-gene tables of a multi-gene job with a leading Gene column."""
+    frames = []
+    for gene in genes:
+        df = get_filtered_df(gene, workdir)
+        if not df.empty:
+            df.insert(0, 'Gene', gene)
+            df['_row_index'] = range(len(df))
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def run_crispr_tool(job):
+    """Run the CRISPR pipeline in-process in the job's directory and update its progress."""
+    result = run_job(job.gene_ids, workdir=job.workdir,
+                     progress=lambda stage, percent: job.set_progress(percent, stage), on_wait=job.set_waiting)
+    if result.unresolved:
+        # Only genes with a result table are shown
+        job.gene_ids = ','.join(result.results)
 
 @app.route('/')
 def index():
@@ -56,59 +76,240 @@ def index():
 
 @app.route('/submit', methods=['POST'])
 def submit():
-    gene_ids = request.form.get('gene_ids')
+    gene_ids = ','.join(gene.strip() for gene in request.form.get('gene_ids', '').split(',') if gene.strip())
     print(f"Received Gene IDs: {gene_ids}")
 
-    thread = threading.Thread(target=run_crispr_tool, args=(gene_ids,))
-    thread.start()
+    # Serve straight from the precomputed guide store or the result cache when every gene is in one of them
+    genes = gene_ids.split(',')
+    guide_store = get_guide_store()
+    result_cache = get_result_cache()
+    sources = [guide_store if guide_store is not None and guide_store.has(gene)
+               else result_cache if result_cache.lookup(gene) else None for gene in genes]
+    if gene_ids and all(sources):
+        job = job_manager.add_finished(gene_ids)
+        if all(source.restore(gene, job.workdir) for gene, source in zip(genes, sources)):
+            print(f"Precomputed results for {gene_ids}")
+            return redirect(url_for('display_dataframe', gene_ids=gene_ids, job_id=job.id))
+        # An entry was evicted after the lookup; compute the genes instead
+        job_manager.discard(job)
 
-    return redirect(url_for('progress_page', gene_ids=gene_ids))
+    try:
+        job = job_manager.submit(gene_ids, run_crispr_tool)
+    except QueueFull as e:
+        # Backpressure: turning a burst away keeps the queued jobs' wait bounded
+        response = Response(f"The server is busy: {e}", status=429, mimetype='text/plain')
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
 
-@app.route('/progress/<gene_ids>')
-def progress_page(gene_ids):
-    return render_template('progress.html', gene_ids=gene_ids)
+    return redirect(url_for('progress_page', job_id=job.id))
+
+@app.route('/progress/<job_id>')
+def progress_page(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return "Job not found", 404
+    return render_template('progress.html', job_id=job.id, gene_ids=job.gene_ids)
+
+def job_status(job):
+    status = job.to_dict()
+    status['queue_position'] = job_manager.queue_position(job)
+    if job.state == 'done':
+        status['redirect_url'] = url_for('display_dataframe', gene_ids=job.gene_ids, job_id=job.id)
+    return status
+
+@app.route('/jobs/<job_id>')
+def job_status_page(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    # Long-poll: with ?since=<version>, hold the request until the job changes or the wait runs out
+    since = request.args.get('since', type=int)
+    if since is not None and not job.is_finished:
+        job.wait(since, min(request.args.get('wait', PROGRESS_WAIT, type=int), PROGRESS_WAIT))
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status, one event per change, closed once the job ends."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def stream():
+        version = request.headers.get('Last-Event-ID', type=int, default=-1)
+        while True:
+            # A client reconnecting with the last event of a finished job still gets the final status,
+            # which closes its EventSource instead of leaving it on keep-alives
+            if job.version > version or job.is_finished:
+                version = job.version
+                yield f"id: {version}\nevent: status\ndata: {json.dumps(job_status(job))}\n\n"
+                if job.is_finished:
+                    return
+            elif job.wait(version, PROGRESS_WAIT) == version:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/progress_status')
 def progress_status():
-    global progress
-    return jsonify({'progress': progress})
+    job = job_manager.get(request.args.get('job_id', ''))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'progress': job.progress})
+
+def table_view(gene_ids, workdir='.'):
+    """Rows of the result table(s) for gene_ids, the gene and table row index behind each one."""
+    genes = [gene for gene in gene_ids.split(',') if gene]
+    if len(genes) > 1:
+        # Combined view: each row's Select posts back to its own gene's table
+        filtered_df = get_combined_df(genes, workdir)
+        row_genes = filtered_df['Gene'].tolist() if not filtered_df.empty else []
+        row_indexes = filtered_df.pop('_row_index').tolist() if not filtered_df.empty else []
+    else:
+        filtered_df = get_filtered_df(gene_ids, workdir)
+        row_genes = [gene_ids] * len(filtered_df)
+        row_indexes = list(range(len(filtered_df)))
+    return genes, filtered_df, row_genes, row_indexes
+
+def cached_response(view, gene_ids, job_id, build, mimetype):
+    """Serve a body built from the job's result tables, cached until one of them changes.
+
+    The ETag is derived from the tables' signatures, so a matching If-None-Match is answered
+    with 304 before anything is read, and gzip-capable clients get a stored compressed copy
+    under an ETag of its own.
+    """
+    workdir = job_workdir(job_id)
+    signature = []
+    for gene in (gene for gene in gene_ids.split(',') if gene):
+        path = os.path.join(workdir, f'{gene}_CRISPR_tgts.csv')
+        signature.append((gene, file_signature(path) if os.path.exists(path) else None))
+    signature = tuple(signature)
+    use_gzip = bool(request.accept_encodings['gzip'])
+    etag = hashlib.sha1(repr((view, os.path.abspath(workdir), job_id, signature)).encode()).hexdigest()
+    # A strong validator names one representation, so the gzip body gets its own
+    if use_gzip:
+        etag += '-gzip'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        def render():
+            body = build(workdir).encode()
+            return body, gzip.compress(body)
+        body, compressed = page_cache.get((view, os.path.abspath(workdir), gene_ids, job_id), signature, render)
+        if use_gzip:
+            response = Response(compressed, mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/dataframe/<gene_ids>')
 def display_dataframe(gene_ids):
+    job_id = request.args.get('job_id', '')
+
+    def render(workdir):
+        genes, filtered_df, row_genes, row_indexes = table_view(gene_ids, workdir)
+        return render_template('dataframe.html', gene_ids=gene_ids, genes=genes, job_id=job_id,
+                               df=filtered_df.to_dict('records'), row_genes=row_genes, row_indexes=row_indexes)
+
     try:
-        filtered_df = get_filtered_df(gene_ids)
-        filtered_html = filtered_df.to_html(classes='table table-striped', index=True)
-        return render_template('dataframe.html', table=filtered_html, gene_ids=gene_ids, df=filtered_df.to_dict('records'))
+        return cached_response('html', gene_ids, job_id, render, 'text/html')
     except FileNotFoundError as e:
         return f"File not found: {e}", 404
 
+@app.route('/api/dataframe/<gene_ids>')
+def dataframe_api(gene_ids):
+    """JSON variant of /dataframe: the table rows plus the gene and row index /select_row expects."""
+    job_id = request.args.get('job_id', '')
+
+    def render(workdir):
+        genes, filtered_df, row_genes, row_indexes = table_view(gene_ids, workdir)
+        return (f'{{"genes": {json.dumps(genes)}, "row_genes": {json.dumps(row_genes)}, '
+                f'"row_indexes": {json.dumps(row_indexes)}, "rows": {filtered_df.to_json(orient="records")}}}')
+
+    try:
+        return cached_response('json', gene_ids, job_id, render, 'application/json')
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+
 @app.route('/select_row', methods=['POST'])
 def select_row():
     row_index = int(request.form.get('row_index'))
     gene_ids = request.form.get('gene_ids')
-    filtered_df = get_filtered_df(gene_ids)
-    
-    if row_index in filtered_df.index:
-        selected_target = filtered_df.loc[row_index]
-        selected_csv_file = f'{gene_ids}_selected_row.csv'
-        selected_target.to_frame().T.to_csv(selected_csv_file, index=False)
-        
-        command = ['python3', 'process_selected_row.py', selected_csv_file]
-        result = subprocess.run(command, capture_output=True, text=True)
-        
-        processed_output_file = selected_csv_file.replace('.csv', '_processed_output.txt')
-        if os.path.exists(processed_output_file):
-            redirect_url = url_for('show_processed_txt', filename=os.path.basename(processed_output_file))
-            return jsonify({'status': 'success', 'redirect_url': redirect_url})
-        else:
-            return jsonify({'status': 'error', 'message': 'Processed output file not found.'})
-    else:
-        return jsonify({'status': 'error', 'message': 'Invalid row index'})
+    job_id = request.form.get('job_id', '')
+    try:
+        # Only check the row exists; /design builds the page from the same in-memory donors or table
+        workdir = job_workdir(job_id)
+        rows = load_donors(workdir, gene_ids)
+        if rows is None:
+            rows = load_table(os.path.join(workdir, f'{gene_ids}_CRISPR_tgts.csv'))
+        if not 0 <= row_index < len(rows):
+            raise IndexError('Invalid row index')
+    except (FileNotFoundError, IndexError) as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+    redirect_url = url_for('show_design', gene_ids=gene_ids, row_index=row_index, job_id=job_id or None)
+    return jsonify({'status': 'success', 'redirect_url': redirect_url})
+
+def get_design(gene_ids, row_index, workdir='.'):
+    """Donor design for one table row, precomputed when the job finished or designed now for older jobs."""
+    designs = load_donors(workdir, gene_ids)
+    if designs is not None:
+        if not 0 <= row_index < len(designs):
+            raise IndexError('Invalid row index')
+        return designs[row_index]
+    filtered_df = get_filtered_df(gene_ids, workdir)
+    if row_index not in filtered_df.index:
+        raise IndexError('Invalid row index')
+    selected_target = filtered_df.loc[row_index]
+    with open(os.path.join(workdir, f'{gene_ids}_variables.json')) as file:
+        variables = json.load(file)
+    try:
+        return design_donor(variables['gene_ids'], selected_target['target'], selected_target['orientation'],
+                            selected_target['Distance from Exon'], variables['last_exon_seq'], variables['gdna_sequence'])
+    except ValueError as e:
+        return {'target': selected_target['target'], 'orientation': selected_target['orientation'],
+                'distance_from_exon': selected_target['Distance from Exon'], 'error': str(e)}
+
+@app.route('/design/<gene_ids>/<int:row_index>')
+def show_design(gene_ids, row_index):
+    try:
+        design = get_design(gene_ids, row_index, job_workdir(request.args.get('job_id', '')))
+    except (FileNotFoundError, IndexError):
+        return "Design not found", 404
+    return render_template('show_txt.html', content=format_design(design), gene_id=gene_ids)
+
+@app.route('/metrics')
+def metrics_page():
+    """Prometheus scrape endpoint: stage histograms and counters plus current job counts."""
+    lines = ["# HELP crispr_jobs Jobs currently known to the scheduler by state.", "# TYPE crispr_jobs gauge"]
+    states = {}
+    for job in list(job_manager.jobs.values()):
+        states[job.state] = states.get(job.state, 0) + 1
+    for state in ('queued', 'running', 'done', 'failed'):
+        lines.append(f'crispr_jobs{{state="{state}"}} {states.get(state, 0)}')
+    admission = get_admission()
+    lines += ["# HELP crispr_flashfry_slots FlashFry runs admitted, waiting, and allowed at once.",
+              "# TYPE crispr_flashfry_slots gauge",
+              f'crispr_flashfry_slots{{state="active"}} {admission.active}',
+              f'crispr_flashfry_slots{{state="waiting"}} {admission.waiting}',
+              f'crispr_flashfry_slots{{state="limit"}} {admission.slots}']
+    guide_store = get_guide_store()
+    if guide_store is not None:
+        lines += ["# HELP crispr_guide_store_lookups_total Guide store lookups; stale rows were built under other settings.",
+                  "# TYPE crispr_guide_store_lookups_total counter"]
+        lines += [f'crispr_guide_store_lookups_total{{outcome="{outcome}"}} {count}'
+                  for outcome, count in sorted(guide_store.lookups.items())]
+    return Response(get_metrics().render() + "\n".join(lines) + "\n", mimetype='text/plain; version=0.0.4')
 
 @app.route('/show_processed_txt/<filename>')
 def show_processed_txt(filename):
     try:
-        file_path = os.path.join('.', filename)
+        file_path = os.path.join(job_workdir(request.args.get('job_id', '')), os.path.basename(filename))
         with open(file_path, 'r') as file:
             content = file.read()
         return render_template('show_txt.html', content=content)
@@ -116,4 +317,7 @@ def show_processed_txt(filename):
         return "File not found", 404
 
 if __name__ == '__main__':
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if FLASHFRY_WORKERS > 0 and os.path.exists(FLASHFRY_JAR) and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_service()
     app.run(host='0.0.0.0', port=5000, debug=True)
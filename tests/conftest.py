@@ -0,0 +1,9 @@
+import os, sys, tempfile
+
+# Modules create their job, cache and store locations at import time; keep those out of the checkout
+_scratch = tempfile.mkdtemp(prefix="crispr-tests-")
+for name, value in (("CRISPR_JOBS_DIR", "jobs"), ("CRISPR_RESULT_CACHE", "result_cache"),
+                    ("CRISPR_GUIDE_STORE", "guide_store.sqlite3"), ("CRISPR_LOOKUP_CACHE", "lookup_cache.sqlite3")):
+    os.environ.setdefault(name, os.path.join(_scratch, value))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
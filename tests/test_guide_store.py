@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import sequence_provider
+from guide_store import GuideStore
+
+TABLE_CSV = "target,orientation,Distance from Exon\nACGTACGTACGTACGTACGTAGG,F,5\n"
+
+
+@pytest.fixture
+def fasta(tmp_path, monkeypatch):
+    path = tmp_path / "genome.fa"
+    path.write_text(">chr1\nACGTACGTAC\n")
+    (tmp_path / "genome.fa.fai").write_text("chr1\t10\t6\t10\t11\n")
+    # Module defaults as the offline builders see them; restored after the test
+    monkeypatch.setattr(sequence_provider, "SEQUENCE_SOURCE", "auto")
+    monkeypatch.setattr(sequence_provider, "GENOME_FASTA", str(path))
+    monkeypatch.setattr(sequence_provider, "_provider", None)
+    return path
+
+
+def test_store_built_offline_is_served(fasta, tmp_path, monkeypatch):
+    store = GuideStore(str(tmp_path / "store.sqlite3"))
+    store.put("TP53", TABLE_CSV, {"gene_ids": "TP53"}, [], aliases=["ENSG00000141510"])
+
+    import server
+    # server.py's own configuration, applied after the store was built
+    sequence_provider.configure("local")
+    monkeypatch.setattr(server, "get_guide_store", lambda: store)
+    assert store.has("TP53") and store.has("ENSG00000141510")
+
+    response = server.app.test_client().post("/submit", data={"gene_ids": "TP53"})
+    assert response.status_code == 302
+    assert "/dataframe/TP53" in response.headers["Location"]
+    job = next(job for job in server.job_manager.jobs.values() if job.gene_ids == "TP53")
+    with open(os.path.join(job.workdir, "TP53_CRISPR_tgts.csv")) as table_file:
+        assert table_file.read() == TABLE_CSV
+
+
+def test_stale_store_rows_are_reported(fasta, tmp_path, monkeypatch):
+    store = GuideStore(str(tmp_path / "store.sqlite3"))
+    store.put("TP53", TABLE_CSV, {"gene_ids": "TP53"}, [])
+    sequence_provider.configure("ensembl")
+    assert not store.has("TP53")
+    assert store.lookups == {"hit": 0, "stale": 1, "missing": 0}
+
+    import server
+    monkeypatch.setattr(server, "get_guide_store", lambda: store)
+    metrics = server.app.test_client().get("/metrics").get_data(as_text=True)
+    assert 'crispr_guide_store_lookups_total{outcome="stale"} 1' in metrics
@@ -0,0 +1,34 @@
+import threading
+
+from job_manager import JobManager
+
+
+def test_queue_position_while_jobs_start(tmp_path):
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+    first = manager.submit("A", lambda job: release.wait(5))
+    queued = [manager.submit(gene, lambda job: None) for gene in "BCD"]
+    assert [manager.queue_position(job) for job in queued] == [1, 2, 3]
+
+    positions, errors = [], []
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            try:
+                positions.extend(manager.queue_position(job) for job in queued)
+            except Exception as e:
+                errors.append(e)
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    release.set()
+    for job in [first, *queued]:
+        job.wait(-1, 5)
+        while not job.is_finished:
+            job.wait(job.version, 5)
+    stop.set()
+    poller.join()
+    assert errors == []
+    assert set(positions) <= {0, 1, 2, 3}
+    assert [manager.queue_position(job) for job in queued] == [0, 0, 0]
@@ -0,0 +1,43 @@
+from annotation_index import build_index, AnnotationIndex
+from crispr_webtooltest import last_exon_from_coordinates
+
+# Minus-strand gene whose 3' exon, E3, is the leftmost; its CDS stops short of the stop codon at 1400-1402
+EXONS = [("E1", 1, 8000, 8600, 8000, 8500), ("E2", 2, 5000, 5300, 5000, 5300), ("E3", 3, 900, 1500, 1403, 1500)]
+
+
+def write_gtf(path):
+    attributes = 'gene_id "ENSG0001"; gene_name "MINUS"; gene_type "protein_coding"'
+    lines = [f'chr7\tE\tgene\t900\t8600\t.\t-\t.\t{attributes};',
+             f'chr7\tE\ttranscript\t900\t8600\t.\t-\t.\t{attributes}; transcript_id "ENST0001"; tag "Ensembl_canonical";']
+    for exon_id, number, start, end, cds_start, cds_end in EXONS:
+        exon = f'{attributes}; transcript_id "ENST0001"; exon_number {number}; exon_id "{exon_id}";'
+        lines.append(f'chr7\tE\texon\t{start}\t{end}\t.\t-\t.\t{exon}')
+        lines.append(f'chr7\tE\tCDS\t{cds_start}\t{cds_end}\t.\t-\t0\t{exon}')
+    lines.append(f'chr7\tE\tstop_codon\t1400\t1402\t.\t-\t0\t{attributes}; transcript_id "ENST0001"; exon_number 3;')
+    path.write_text("\n".join(lines) + "\n")
+
+
+def ebi_coordinates():
+    # EBI reports the coding part of each exon, begin > end on the minus strand
+    exons = [{"id": exon_id, "genomeLocation": {"begin": {"position": cds_end}, "end": {"position": cds_start}}}
+             for exon_id, _, _, _, cds_start, cds_end in EXONS]
+    return {"gnCoordinate": [{"ensemblGeneId": "ENSG0001",
+                              "genomicLocation": {"chromosome": "7", "exon": exons}}]}
+
+
+def test_minus_strand_last_exon_agrees(tmp_path):
+    write_gtf(tmp_path / "genes.gtf")
+    build_index(str(tmp_path / "genes.gtf"), str(tmp_path / "index"))
+    local = AnnotationIndex(str(tmp_path / "index")).last_exon("MINUS")
+    remote = last_exon_from_coordinates(ebi_coordinates())
+    assert local["exon_id"] == remote["exon_id"] == "E3"
+    assert (local["start"], local["end"]) == (remote["start"], remote["end"]) == (1500, 1403)
+    assert local["chromosome"] == remote["chromosome"]
+
+
+def test_plus_strand_last_exon_is_rightmost():
+    response = {"gnCoordinate": [{"ensemblGeneId": "ENSG0002", "genomicLocation": {"chromosome": "1", "exon": [
+        {"id": "E1", "genomeLocation": {"begin": {"position": 100}, "end": {"position": 200}}},
+        {"id": "E2", "genomeLocation": {"begin": {"position": 900}, "end": {"position": 950}}},
+    ]}}]}
+    assert last_exon_from_coordinates(response)["exon_id"] == "E2"
@@ -0,0 +1,23 @@
+import pytest
+
+import pipeline
+from library import design_shard, FINISHED
+
+
+def raising(error):
+    def run_job(*args, **kwargs):
+        raise error
+    return run_job
+
+
+@pytest.mark.parametrize("error, status", [
+    (pipeline.NoTargetsError("No last exon could be resolved for A, B"), "unresolved"),
+    # A truncated REST response or an unreadable scored TSV must not drop the shard for good
+    (ValueError("Expecting value: line 1 column 1 (char 0)"), "failed"),
+    (RuntimeError("Could not resolve A: HTTPError: 503; B: no last exon found"), "failed"),
+])
+def test_shard_errors(tmp_path, monkeypatch, error, status):
+    monkeypatch.setattr(pipeline, "run_job", raising(error))
+    records = design_shard(["A", "B"], str(tmp_path), "csv")
+    assert [record["status"] for record in records] == [status, status]
+    assert (status in FINISHED) == isinstance(error, pipeline.NoTargetsError)
@@ -0,0 +1,70 @@
+import os, shutil, threading
+
+import pandas as pd
+
+import pipeline
+import result_cache
+from result_cache import ResultCache
+
+
+def write_table(tmp_path, gene):
+    path = tmp_path / f"{gene}_CRISPR_tgts.csv"
+    path.write_text("target,orientation\n" + "ACGT,F\n" * 50)
+    return str(path)
+
+
+def test_concurrent_store_and_evict(tmp_path):
+    # Room for a few entries only, so every store also evicts
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2000)
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(20):
+                gene = f"G{(n + i) % 6}"
+                cache.store(gene, write_table(tmp_path, f"{gene}-{n}"), {"gene_ids": gene}, [])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_evict_tolerates_entries_removed_by_another_process(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=0)
+    cache.store("TP53", write_table(tmp_path, "TP53"), {}, [])
+    entry = cache._entry("TP53")
+    getmtime = os.path.getmtime
+
+    def removed_first(path):
+        shutil.rmtree(entry, ignore_errors=True)
+        return getmtime(path)
+
+    monkeypatch.setattr(result_cache.os.path, "getmtime", removed_first)
+    cache.evict()
+
+
+def test_restore_after_eviction_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.store("TP53", write_table(tmp_path, "TP53"), {}, [])
+    entry = cache.lookup("TP53")
+    shutil.rmtree(entry)
+    cache.lookup = lambda gene: entry
+    workdir = tmp_path / "job"
+    workdir.mkdir()
+    assert cache.restore("TP53", str(workdir)) is False
+
+
+def test_persist_survives_cache_failure(tmp_path, monkeypatch):
+    class FullCache:
+        def store(self, *args):
+            raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(pipeline, "get_result_cache", lambda: FullCache())
+    result = pipeline.GeneResult("TP53", pd.DataFrame({"target": ["ACGT"]}), {"gene_ids": "TP53"})
+    pipeline.persist({"TP53": result}, str(tmp_path))
+    assert os.path.exists(tmp_path / "TP53_CRISPR_tgts.csv")
@@ -0,0 +1,44 @@
+import json
+
+import result_cache
+import server
+
+
+def finished_job():
+    job = server.job_manager.add_finished("TP53")
+    with open(f"{job.workdir}/TP53_CRISPR_tgts.csv", "w") as table_file:
+        table_file.write("target,orientation,Distance from Exon\nACGTACGTACGTACGTACGTAGG,F,5\n")
+    return job
+
+
+def test_gzip_and_identity_bodies_have_different_etags():
+    job = finished_job()
+    client = server.app.test_client()
+    url = f"/api/dataframe/TP53?job_id={job.id}"
+    identity = client.get(url)
+    compressed = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert identity.headers["ETag"] != compressed.headers["ETag"]
+
+    # Each validator only matches its own representation
+    assert client.get(url, headers={"If-None-Match": identity.headers["ETag"]}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": identity.headers["ETag"],
+                                    "Accept-Encoding": "gzip"}).status_code == 200
+
+
+def test_select_and_show_design_read_donors_once(monkeypatch):
+    job = finished_job()
+    design = {"gene": "TP53", "target": "ACGTACGTACGTACGTACGTAGG", "orientation": "F", "distance_from_exon": 5,
+              "left_ai1": "AAA", "right_ai1": "CCC", "left_arm": "GGG", "right_arm": "TTT"}
+    with open(f"{job.workdir}/TP53_donors.json", "w") as donors_file:
+        json.dump([design], donors_file)
+    reads = []
+    monkeypatch.setattr(result_cache.json, "load", lambda file: reads.append(file.name) or json.loads(file.read()))
+
+    client = server.app.test_client()
+    selected = client.post("/select_row", data={"row_index": 0, "gene_ids": "TP53", "job_id": job.id}).get_json()
+    assert selected["status"] == "success"
+    page = client.get(selected["redirect_url"])
+    assert page.status_code == 200 and b"Left_arm sequence" in page.data
+    assert client.post("/select_row", data={"row_index": 1, "gene_ids": "TP53", "job_id": job.id}).get_json()["status"] == "error"
+    assert len(reads) == 1